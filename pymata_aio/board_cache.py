@@ -0,0 +1,150 @@
+"""
+Copyright (c) 2016 Alan Yorinks All rights reserved.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU  General Public
+License as published by the Free Software Foundation; either
+version 3 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""
+
+import json
+import os
+import time
+
+from pymata_aio.constants import Constants
+
+
+class BoardCache:
+    """
+    This class keeps a description of each board that PymataCore has
+    connected to in a JSON file, so that a later start up can build its
+    pin tables without waiting for the board to answer queries.
+
+    There is one entry per port (a com port name, or address:port for IP
+    connections) and firmware ID string, so a description is only used
+    for the sketch it was read from. An entry contains the firmware ID
+    string, the analog map, the capability report and the resulting
+    digital and analog pin counts.
+    """
+
+    def __init__(self, file_name):
+        """
+        :param file_name: Path of the JSON cache file. It is created when
+                          the first entry is saved.
+        """
+        self.file_name = file_name
+
+    def load(self, port, firmware_id):
+        """
+        Retrieve the cached description for a port and firmware.
+
+        :param port: Port key
+        :param firmware_id: Firmware ID string reported by the board
+        :returns: A dictionary with firmware_id, analog_map,
+                  capability_report, digital_pins and analog_pins entries
+                  or None if the port and firmware are not cached
+        """
+        entry = self._port_entries(self._read(), port).get(firmware_id)
+        if not isinstance(entry, dict):
+            return None
+        return entry
+
+    def save(self, port, firmware_id, analog_map, capability_report=None):
+        """
+        Store the description of the board attached to a port.
+
+        :param port: Port key
+        :param firmware_id: Firmware ID string reported by the board
+        :param analog_map: Analog map query reply
+        :param capability_report: Capability query reply
+        :returns: No return value.
+        """
+        analog_map = list(analog_map)
+        entry = {'firmware_id': firmware_id,
+                 'analog_map': analog_map,
+                 'capability_report': list(capability_report or []),
+                 'digital_pins': len(analog_map),
+                 'analog_pins': len([pin for pin in analog_map
+                                     if pin != Constants.IGNORE]),
+                 'time_stamp': time.time()}
+        entries = self._read()
+        port_entries = self._port_entries(entries, port)
+        port_entries[firmware_id] = entry
+        entries[port] = port_entries
+        self._write(entries)
+
+    def get_value(self, key, default=None):
+        """
+        Retrieve a value stored alongside the port entries, such as the
+        last port a board was found on.
+
+        :param key: Value name
+        :param default: Returned if the value is not stored
+        :returns: Stored value
+        """
+        return self._read().get('_' + key, default)
+
+    def set_value(self, key, value):
+        """
+        Store a value alongside the port entries.
+
+        :param key: Value name
+        :param value: Any JSON serializable value
+        :returns: No return value.
+        """
+        entries = self._read()
+        entries['_' + key] = value
+        self._write(entries)
+
+    @staticmethod
+    def _port_entries(entries, port):
+        """
+        Find the entries for a port, keyed by firmware ID. Entries written
+        by older versions, with no firmware ID key, are ignored.
+
+        :param entries: Dictionary of cache entries
+        :param port: Port key
+        :returns: Dictionary of firmware ID to entry
+        """
+        port_entries = entries.get(port)
+        if not isinstance(port_entries, dict) or \
+                'analog_map' in port_entries:
+            return {}
+        return port_entries
+
+    def _read(self):
+        """
+        Read the cache file. A missing or damaged file is treated as empty.
+
+        :returns: Dictionary of cache entries
+        """
+        try:
+            with open(self.file_name) as cache_file:
+                entries = json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def _write(self, entries):
+        """
+        Replace the cache file. The new contents are written to a temporary
+        file first so that a crash never leaves a partial cache behind.
+
+        :param entries: Dictionary of cache entries
+        :returns: No return value.
+        """
+        temp_name = self.file_name + '.tmp'
+        with open(temp_name, 'w') as cache_file:
+            json.dump(entries, cache_file, indent=2, sort_keys=True)
+        os.replace(temp_name, self.file_name)
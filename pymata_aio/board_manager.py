@@ -0,0 +1,255 @@
+"""
+Copyright (c) 2016 Alan Yorinks All rights reserved.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU  General Public
+License as published by the Free Software Foundation; either
+version 3 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+
+from pymata_aio import port_discovery
+from pymata_aio.pymata_core import PymataCore
+
+
+class BoardManager:
+    """
+    This class runs several PymataCore instances on one event loop.
+
+    Each board is created with exit_on_error=False, so a board that fails
+    to start, or that stops responding, is closed and recorded in the
+    failed dictionary while the remaining boards keep running.
+
+    Boards are identified by a name chosen when they are added.
+    """
+
+    def __init__(self, loop=None, log_output=False):
+        """
+        :param loop: Event loop shared by all boards. Defaults to
+                     asyncio.get_event_loop().
+        :param log_output: Passed to every PymataCore
+        """
+        self.loop = loop or asyncio.get_event_loop()
+        self.log_output = log_output
+
+        # board name: PymataCore
+        self.boards = OrderedDict()
+
+        # board name: exception that stopped the board
+        self.failed = OrderedDict()
+
+    def add_board(self, name, **kwargs):
+        """
+        Create a PymataCore for a board. The board is not started.
+
+        :param name: Unique board name
+        :param kwargs: PymataCore arguments, such as com_port, ip_address
+                       or transport
+        :returns: PymataCore instance
+        """
+        if name in self.boards:
+            raise ValueError('Board ' + str(name) + ' already added')
+        kwargs.setdefault('log_output', self.log_output)
+        kwargs['loop'] = self.loop
+        kwargs['exit_on_error'] = False
+        board = PymataCore(**kwargs)
+        self.boards[name] = board
+        return board
+
+    def add_discovered_boards(self, ports=None, **kwargs):
+        """
+        Probe serial ports for Firmata boards and add one board for every
+        port that answers. The port name is used as the board name.
+
+        :param ports: List of ports to probe. None probes the USB serial
+                      ports of Arduino compatible boards, see
+                      port_discovery.list_serial_ports.
+        :param kwargs: PymataCore arguments applied to every board
+        :returns: List of board names added
+        """
+        arduino_wait = kwargs.get('arduino_wait', 2)
+        query_timeout = kwargs.get('query_timeout', 2)
+        names = []
+        for port, firmware in port_discovery.discover_boards(
+                ports, 57600, arduino_wait, query_timeout):
+            if port not in self.boards:
+                self.add_board(port, com_port=port, **kwargs)
+                names.append(port)
+        return names
+
+    def board(self, name):
+        """
+        :param name: Board name
+        :returns: PymataCore instance for the board
+        """
+        return self.boards[name]
+
+    def running(self):
+        """
+        :returns: Names of the boards that have not failed or been closed
+        """
+        names = []
+        for name, board in self.boards.items():
+            if board.error is not None and name not in self.failed:
+                self._report_failure(name, board.error)
+            if not board.closed:
+                names.append(name)
+        return names
+
+    def start(self, names=None):
+        """
+        Start the boards. This is intended for applications that do not
+        use asyncio coroutines directly.
+
+        :param names: Boards to start. None starts every board.
+        :returns: Names of the boards that started
+        """
+        return self.loop.run_until_complete(self.start_aio(names))
+
+    async def start_aio(self, names=None):
+        """
+        Start the boards concurrently. A board that fails to start is
+        closed and recorded in failed.
+
+        :param names: Boards to start. None starts every board.
+        :returns: Names of the boards that started
+        """
+        if names is None:
+            names = list(self.boards)
+        results = await asyncio.gather(
+            *[self.boards[name].start_aio() for name in names],
+            return_exceptions=True)
+
+        started = []
+        for name, result in zip(names, results):
+            if isinstance(result, BaseException):
+                self._report_failure(name, result)
+                await self.boards[name].close()
+            else:
+                started.append(name)
+        return started
+
+    async def fan_out(self, method, *args, names=None, **kwargs):
+        """
+        Call a PymataCore coroutine method on several boards concurrently.
+        A board that raises an exception is closed and recorded in failed.
+
+        :param method: PymataCore method name, for example 'digital_write'
+        :param args: Method arguments
+        :param names: Boards to call. None calls every running board.
+        :param kwargs: Method keyword arguments
+        :returns: Dictionary of board name to method return value
+        """
+        if names is None:
+            names = self.running()
+        else:
+            names = [name for name in names if not self.boards[name].closed]
+        results = await asyncio.gather(
+            *[getattr(self.boards[name], method)(*args, **kwargs)
+              for name in names],
+            return_exceptions=True)
+
+        replies = OrderedDict()
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                self._report_failure(name, result)
+                await self.boards[name].close()
+            else:
+                replies[name] = result
+        return replies
+
+    async def analog_write(self, pin, value, names=None):
+        """
+        Set a PWM pin on several boards.
+
+        :param pin: PWM pin number
+        :param value: Pin value
+        :param names: Boards to write. None writes every running board.
+        :returns: No return value
+        """
+        await self.fan_out('analog_write', pin, value, names=names)
+
+    async def digital_write(self, pin, value, names=None):
+        """
+        Set a digital pin on several boards.
+
+        :param pin: Pin number
+        :param value: Pin value
+        :param names: Boards to write. None writes every running board.
+        :returns: No return value
+        """
+        await self.fan_out('digital_write', pin, value, names=names)
+
+    async def set_pin_mode(self, pin_number, pin_state, callback=None,
+                           callback_type=None, names=None):
+        """
+        Set the mode of a pin on several boards.
+
+        :param pin_number: Arduino pin number
+        :param pin_state: INPUT/OUTPUT/ANALOG/PWM
+        :param callback: Optional callback registered on every board for
+                         an INPUT or ANALOG pin
+        :param callback_type: Constants.CB_TYPE_DIRECT or
+                              Constants.CB_TYPE_ASYNCIO
+        :param names: Boards to configure. None configures every running
+                      board.
+        :returns: No return value
+        """
+        await self.fan_out('set_pin_mode', pin_number, pin_state, callback,
+                           callback_type, names=names)
+
+    async def get_firmware_version(self, names=None):
+        """
+        Retrieve the firmware ID of several boards.
+
+        :param names: Boards to query. None queries every running board.
+        :returns: Dictionary of board name to firmware ID
+        """
+        return await self.fan_out('get_firmware_version', names=names)
+
+    async def send_reset(self, names=None):
+        """
+        Send a Firmata reset to several boards.
+
+        :param names: Boards to reset. None resets every running board.
+        :returns: No return value
+        """
+        await self.fan_out('send_reset', names=names)
+
+    async def close(self, names=None):
+        """
+        Reset and close boards without stopping the event loop.
+
+        :param names: Boards to close. None closes every board.
+        :returns: No return value
+        """
+        if names is None:
+            names = list(self.boards)
+        await asyncio.gather(*[self.boards[name].close() for name in names])
+
+    def _report_failure(self, name, exception):
+        """
+        Record and report a board failure
+
+        :param name: Board name
+        :param exception: Exception that stopped the board
+        :returns: No return value.
+        """
+        self.failed[name] = exception
+        log_string = 'Board ' + str(name) + ' failed: ' + str(exception)
+        if self.log_output:
+            logging.error(log_string)
+        else:
+            print(log_string)
@@ -0,0 +1,557 @@
+"""
+Copyright (c) 2016 Alan Yorinks All rights reserved.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU  General Public
+License as published by the Free Software Foundation; either
+version 3 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import threading
+
+from pymata_aio.board_manager import BoardManager
+from pymata_aio.constants import Constants
+
+# seconds between checks for boards that have failed in a worker
+FAILURE_CHECK_INTERVAL = 1.0
+
+
+class BoardSupervisor:
+    """
+    This class spreads boards across worker processes so that decoding
+    for many boards is not limited to a single CPU core.
+
+    Each worker process runs a BoardManager on its own event loop. The
+    supervisor routes commands to the worker that owns a board over a
+    pipe. Pin updates for pins configured through set_pin_mode are
+    batched by the worker, streamed back over the same pipe and kept in
+    the supervisor, so analog_read and digital_read do not involve the
+    worker at all.
+
+    The supervisor API is synchronous. Callbacks are called on the
+    receiver thread of the worker that owns the board.
+    """
+
+    def __init__(self, workers=None, log_output=False, start_method=None):
+        """
+        :param workers: Number of worker processes. Defaults to the number
+                        of CPU cores. Boards are assigned to workers in
+                        the order they are added.
+        :param log_output: Passed to every PymataCore
+        :param start_method: multiprocessing start method, for example
+                             'spawn'. None uses the platform default.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.log_output = log_output
+        self.context = multiprocessing.get_context(start_method)
+
+        # board name: PymataCore keyword arguments
+        self.boards = {}
+
+        # board name: worker index
+        self.board_worker = {}
+
+        # board name: exception description
+        self.failed = {}
+
+        # board name: exception raised by a write that was not waited for
+        self.write_errors = {}
+
+        # (board name, 'analog' or 'digital', pin): latest value
+        self.values = {}
+
+        # (board name, 'analog' or 'digital', pin): callback
+        self.callbacks = {}
+
+        self.closing = False
+        self.processes = []
+        self.connections = []
+        self.send_locks = []
+        self.receivers = []
+
+        self._request_id = 0
+        self._request_lock = threading.Lock()
+
+        # request id: (worker index, concurrent.futures.Future)
+        self._pending = {}
+
+    def add_board(self, name, **kwargs):
+        """
+        Add a board. Boards must be added before start() is called.
+
+        :param name: Unique board name
+        :param kwargs: PymataCore arguments, such as com_port. They are
+                       sent to the worker process, so they must be
+                       picklable.
+        :returns: No return value.
+        """
+        if name in self.boards:
+            raise ValueError('Board ' + str(name) + ' already added')
+        if self.processes:
+            raise RuntimeError('Boards must be added before start()')
+        self.boards[name] = kwargs
+        self.board_worker[name] = len(self.board_worker) % self.workers
+
+    def start(self, timeout=None):
+        """
+        Start the worker processes and wait for every board to start.
+
+        :param timeout: Seconds to wait for the workers. None waits
+                        indefinitely.
+        :returns: Names of the boards that started
+        """
+        worker_count = min(self.workers, len(self.boards))
+        started_futures = []
+        for worker in range(worker_count):
+            boards = {name: kwargs for name, kwargs in self.boards.items()
+                      if self.board_worker[name] == worker}
+            connection, worker_connection = self.context.Pipe()
+            process = self.context.Process(
+                target=_worker_main,
+                args=(worker_connection, boards, self.log_output),
+                daemon=True)
+            process.start()
+            worker_connection.close()
+
+            self.processes.append(process)
+            self.connections.append(connection)
+            self.send_locks.append(threading.Lock())
+
+            future = concurrent.futures.Future()
+            self._pending[('start', worker)] = (worker, future)
+            started_futures.append(future)
+
+            receiver = threading.Thread(target=self._receive,
+                                        args=(worker,), daemon=True)
+            receiver.start()
+            self.receivers.append(receiver)
+
+        started = []
+        for future in started_futures:
+            started += future.result(timeout)
+        return started
+
+    def running(self):
+        """
+        :returns: Names of the boards that have not failed
+        """
+        return [name for name in self.boards if name not in self.failed]
+
+    def call(self, name, method, *args, timeout=None, **kwargs):
+        """
+        Call a PymataCore coroutine method for a board in its worker
+        process and wait for the result.
+
+        :param name: Board name
+        :param method: PymataCore method name
+        :param args: Method arguments. They must be picklable.
+        :param timeout: Seconds to wait for the result. None waits
+                        indefinitely.
+        :param kwargs: Method keyword arguments
+        :returns: Method return value
+        """
+        return self.call_async(name, method, *args,
+                               **kwargs).result(timeout)
+
+    def call_async(self, name, method, *args, **kwargs):
+        """
+        Call a PymataCore coroutine method for a board in its worker
+        process without waiting.
+
+        :param name: Board name
+        :param method: PymataCore method name
+        :param args: Method arguments. They must be picklable.
+        :param kwargs: Method keyword arguments
+        :returns: A concurrent.futures.Future for the method return value
+        """
+        return self._request(name, 'call', method, args, kwargs)
+
+    def fan_out(self, method, *args, names=None, timeout=None, **kwargs):
+        """
+        Call a PymataCore coroutine method on several boards. The calls
+        are sent to all workers before waiting for any result.
+
+        :param method: PymataCore method name
+        :param args: Method arguments
+        :param names: Boards to call. None calls every running board.
+        :param timeout: Seconds to wait for each result
+        :param kwargs: Method keyword arguments
+        :returns: Dictionary of board name to return value or exception
+        """
+        if names is None:
+            names = self.running()
+        futures = [(name, self.call_async(name, method, *args, **kwargs))
+                   for name in names]
+        results = {}
+        for name, future in futures:
+            try:
+                results[name] = future.result(timeout)
+            except Exception as ex:
+                results[name] = ex
+        return results
+
+    def set_pin_mode(self, name, pin_number, pin_state, callback=None):
+        """
+        Set the mode of a pin. The values of ANALOG and INPUT pins are
+        streamed back from the worker.
+
+        :param name: Board name
+        :param pin_number: Arduino pin number
+        :param pin_state: INPUT/OUTPUT/ANALOG/PWM
+        :param callback: Optional function called with [pin, value] when
+                         the value of an ANALOG or INPUT pin changes.
+                         It is ignored for other pin modes.
+        :returns: No return value
+        """
+        if pin_state == Constants.ANALOG:
+            kind = 'analog'
+        elif pin_state == Constants.INPUT:
+            kind = 'digital'
+        else:
+            self.call(name, 'set_pin_mode', pin_number, pin_state)
+            return
+        if callback:
+            self.callbacks[(name, kind, pin_number)] = callback
+        self._request(name, 'watch', pin_number, pin_state, kind).result()
+
+    def analog_read(self, name, pin):
+        """
+        :param name: Board name
+        :param pin: Analog pin number
+        :returns: Last value streamed back for the pin
+        """
+        return self.values.get((name, 'analog', pin), 0)
+
+    def digital_read(self, name, pin):
+        """
+        :param name: Board name
+        :param pin: Digital pin number
+        :returns: Last value streamed back for the pin
+        """
+        return self.values.get((name, 'digital', pin), 0)
+
+    def analog_write(self, name, pin, value):
+        """
+        Set a PWM pin without waiting for the worker. If an earlier write
+        to the board failed in the worker, its exception is raised instead.
+
+        :param name: Board name
+        :param pin: PWM pin number
+        :param value: Pin value
+        :returns: No return value
+        """
+        self._write(name, 'analog_write', pin, value)
+
+    def digital_write(self, name, pin, value):
+        """
+        Set a digital pin without waiting for the worker. If an earlier
+        write to the board failed in the worker, its exception is raised
+        instead.
+
+        :param name: Board name
+        :param pin: Pin number
+        :param value: Pin value
+        :returns: No return value
+        """
+        self._write(name, 'digital_write', pin, value)
+
+    def close(self, timeout=5):
+        """
+        Close every board and stop the worker processes.
+
+        :param timeout: Seconds to wait for each worker to exit
+        :returns: No return value
+        """
+        self.closing = True
+        for worker in range(len(self.connections)):
+            try:
+                self._send(worker, ('close', None))
+            except (OSError, EOFError):
+                pass
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        for connection in self.connections:
+            connection.close()
+
+    def _write(self, name, method, pin, value):
+        """
+        Send a write without waiting for the worker. The exception of a
+        failed write is kept in write_errors and raised by the next write
+        to the same board.
+
+        :param name: Board name
+        :param method: PymataCore write method name
+        :param pin: Pin number
+        :param value: Pin value
+        :returns: No return value
+        """
+        error = self.write_errors.pop(name, None)
+        if error:
+            raise error
+
+        def write_done(future):
+            if not future.cancelled() and future.exception():
+                self.write_errors.setdefault(name, future.exception())
+
+        self.call_async(name, method, pin, value).add_done_callback(
+            write_done)
+
+    def _request(self, name, kind, *args):
+        """
+        Send a request for a board to its worker process
+
+        :param name: Board name
+        :param kind: Request type
+        :param args: Request arguments
+        :returns: A concurrent.futures.Future for the reply
+        """
+        future = concurrent.futures.Future()
+        with self._request_lock:
+            self._request_id += 1
+            request_id = self._request_id
+        worker = self.board_worker[name]
+        self._pending[request_id] = (worker, future)
+        try:
+            self._send(worker, (kind, request_id, name) + args)
+        except Exception:
+            del self._pending[request_id]
+            raise
+        return future
+
+    def _send(self, worker, message):
+        """
+        Send a message to a worker process
+
+        :param worker: Worker index
+        :param message: Message tuple
+        :returns: No return value.
+        """
+        with self.send_locks[worker]:
+            self.connections[worker].send(message)
+
+    def _receive(self, worker):
+        """
+        Receiver thread body. It handles replies, failures and pin
+        updates from one worker process until the worker exits.
+
+        :param worker: Worker index
+        :returns: No return value.
+        """
+        connection = self.connections[worker]
+        while True:
+            try:
+                message = connection.recv()
+            except (OSError, EOFError):
+                break
+            kind = message[0]
+            if kind == 'data':
+                for update in message[1]:
+                    key = update[:3]
+                    self.values[key] = update[3]
+                    callback = self.callbacks.get(key)
+                    if callback:
+                        callback([update[2], update[3]])
+            elif kind == 'reply':
+                worker_future = self._pending.pop(message[1], None)
+                if worker_future:
+                    future = worker_future[1]
+                    if message[2]:
+                        future.set_exception(message[3])
+                    else:
+                        future.set_result(message[3])
+            elif kind == 'failed':
+                self._report_failure(message[1], message[2])
+            elif kind == 'started':
+                for name, error in message[2].items():
+                    self._report_failure(name, error)
+                self._pending.pop(('start', worker))[1].set_result(message[1])
+
+        # the worker has gone - fail its boards and outstanding calls
+        for name, board_worker in self.board_worker.items():
+            if self.closing:
+                break
+            if board_worker == worker and name not in self.failed:
+                self._report_failure(name, 'worker process exited')
+        for request_id, (request_worker, future) in \
+                list(self._pending.items()):
+            if request_worker != worker:
+                continue
+            del self._pending[request_id]
+            if request_id == ('start', worker):
+                future.set_result([])
+            else:
+                future.set_exception(RuntimeError('worker process exited'))
+
+    def _report_failure(self, name, error):
+        """
+        Record and report a board failure
+
+        :param name: Board name
+        :param error: Description of the failure
+        :returns: No return value.
+        """
+        self.failed[name] = error
+        log_string = 'Board ' + str(name) + ' failed: ' + str(error)
+        if self.log_output:
+            logging.error(log_string)
+        else:
+            print(log_string)
+
+
+class _Worker:
+    """
+    This class runs in a worker process. It owns a BoardManager and
+    executes the commands sent by BoardSupervisor.
+    """
+
+    def __init__(self, connection, boards, log_output):
+        """
+        :param connection: Pipe connection to the supervisor
+        :param boards: Dictionary of board name to PymataCore arguments
+        :param log_output: Passed to every PymataCore
+        """
+        self.connection = connection
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.manager = BoardManager(self.loop, log_output)
+        for name, kwargs in boards.items():
+            try:
+                self.manager.add_board(name, **kwargs)
+            except Exception as ex:
+                self.manager.failed[name] = ex
+
+        # pin updates waiting to be sent to the supervisor
+        self.updates = []
+        self.reported = set()
+
+    def run(self):
+        """
+        Start the boards and process commands until told to close.
+
+        :returns: No return value.
+        """
+        names = [name for name in self.manager.boards
+                 if name not in self.manager.failed]
+        started = self.loop.run_until_complete(
+            self.manager.start_aio(names))
+        self.reported.update(self.manager.failed)
+        self.connection.send(('started', started,
+                              {name: str(error) for name, error in
+                               self.manager.failed.items()}))
+        self.loop.call_later(FAILURE_CHECK_INTERVAL, self._check_failures)
+        self.loop.run_until_complete(self._serve())
+        self.loop.run_until_complete(self.manager.close())
+
+    async def _serve(self):
+        """
+        Receive commands from the supervisor until told to close.
+
+        :returns: No return value.
+        """
+        while True:
+            try:
+                message = await self.loop.run_in_executor(
+                    None, self.connection.recv)
+            except (OSError, EOFError):
+                # the supervisor has gone
+                return
+            kind = message[0]
+            if kind == 'close':
+                return
+            if kind == 'call':
+                request_id, name, method, args, kwargs = message[1:]
+                asyncio.ensure_future(self._reply(request_id, name, method,
+                                                  *args, **kwargs))
+            elif kind == 'watch':
+                asyncio.ensure_future(self._watch(*message[1:]))
+
+    async def _watch(self, request_id, name, pin, pin_state, kind):
+        """
+        Set a pin mode with a callback that forwards the pin values
+
+        :returns: No return value.
+        """
+        def forward(data):
+            if not self.updates:
+                self.loop.call_soon(self._send_updates)
+            self.updates.append((name, kind, data[0], data[1]))
+
+        await self._reply(request_id, name, 'set_pin_mode', pin, pin_state,
+                          forward)
+
+    async def _reply(self, request_id, name, method, *args, **kwargs):
+        """
+        Run a PymataCore method and send back the result or exception
+
+        :returns: No return value.
+        """
+        try:
+            board = self.manager.board(name)
+            if board.closed:
+                raise RuntimeError('Board ' + str(name) + ' is closed')
+            result = await getattr(board, method)(*args, **kwargs)
+            reply = ('reply', request_id, False, result)
+        except Exception as ex:
+            reply = ('reply', request_id, True, ex)
+        try:
+            self.connection.send(reply)
+        except Exception as ex:
+            # the result or exception could not be pickled
+            self.connection.send(('reply', request_id, True,
+                                  RuntimeError(repr(ex))))
+        self._check_failures(False)
+
+    def _send_updates(self):
+        """
+        Send all pin updates collected during this loop pass as a single
+        message
+
+        :returns: No return value.
+        """
+        updates = self.updates
+        self.updates = []
+        self.connection.send(('data', updates))
+
+    def _check_failures(self, reschedule=True):
+        """
+        Report boards that have failed since the last check
+
+        :param reschedule: Check again after FAILURE_CHECK_INTERVAL
+        :returns: No return value.
+        """
+        self.manager.running()
+        for name, error in self.manager.failed.items():
+            if name not in self.reported:
+                self.reported.add(name)
+                self.connection.send(('failed', name, str(error)))
+        if reschedule:
+            self.loop.call_later(FAILURE_CHECK_INTERVAL,
+                                 self._check_failures)
+
+
+def _worker_main(connection, boards, log_output):
+    """
+    Worker process entry point
+
+    :param connection: Pipe connection to the supervisor
+    :param boards: Dictionary of board name to PymataCore arguments
+    :param log_output: Passed to every PymataCore
+    :returns: No return value.
+    """
+    _Worker(connection, boards, log_output).run()
@@ -56,6 +56,11 @@ class Constants:
     CB_TYPE_DIRECT = None
     CB_TYPE_ASYNCIO = 1
 
+    # outbound command priority classes - lower values are sent first
+    PRIORITY_SAFETY = 0  # reset and other urgent commands
+    PRIORITY_CONTROL = 1  # pin modes, outputs, reporting and queries
+    PRIORITY_BULK = 2  # i2c transfers and other large transfers
+
     # latch states
     LATCH_IGNORE = 0  # this item currently not participating in latching
 
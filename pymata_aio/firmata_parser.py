@@ -0,0 +1,142 @@
+"""
+Copyright (c) 2016 Alan Yorinks All rights reserved.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU  General Public
+License as published by the Free Software Foundation; either
+version 3 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""
+
+from pymata_aio.private_constants import PrivateConstants
+
+
+class FirmataParser:
+    """
+    This class is an incremental decoder for the Firmata byte stream.
+    It performs no I/O. Data is passed to feed() in chunks of any size
+    and every complete message found is returned. A partial message at
+    the end of a chunk is kept and completed by the next call to feed().
+
+    Each message is returned as a (command, data) tuple:
+
+    Analog and digital messages: command is ANALOG_MESSAGE or
+    DIGITAL_MESSAGE and data is [pin or port number, lsb, msb].
+
+    Report version: command is REPORT_VERSION and data is [major, minor].
+
+    Sysex messages: command is the sysex command byte and data is the
+    sysex body, [sysex command, data..., END_SYSEX].
+    """
+
+    # number of data bytes following each message command byte sent
+    # by Firmata. For channel messages (0x80 - 0xEF) the key is the command
+    # with the channel number removed.
+    FIRMATA_DATA_LENGTHS = {PrivateConstants.DIGITAL_MESSAGE: 2,
+                            PrivateConstants.ANALOG_MESSAGE: 2,
+                            PrivateConstants.REPORT_VERSION: 2}
+
+    def __init__(self, data_lengths=None):
+        """
+        :param data_lengths: Optional dictionary of command byte to number
+                             of data bytes. Defaults to the messages sent
+                             by Firmata to the client.
+        """
+        if data_lengths is None:
+            data_lengths = self.FIRMATA_DATA_LENGTHS
+        self.data_lengths = data_lengths
+
+        # state for a partially received non-sysex message
+        self.command = None
+        self.message = None
+        self.remaining = 0
+
+        # a partially received sysex message or None if not in a sysex
+        self.sysex = None
+
+    def reset(self):
+        """
+        Discard any partially received message
+
+        :returns: No return value.
+        """
+        self.command = None
+        self.message = None
+        self.remaining = 0
+        self.sysex = None
+
+    def feed(self, data):
+        """
+        Decode a chunk of the Firmata byte stream.
+
+        :param data: bytes or bytearray received from the board
+        :returns: A list of (command, data) tuples, one per complete message
+        """
+        messages = []
+        index = 0
+        length = len(data)
+
+        while index < length:
+            # continue assembling a sysex message
+            if self.sysex is not None:
+                end = data.find(PrivateConstants.END_SYSEX, index)
+                if end == -1:
+                    self.sysex += data[index:]
+                    break
+                self.sysex += data[index:end + 1]
+                index = end + 1
+                sysex = list(self.sysex)
+                self.sysex = None
+                # ignore an empty sysex
+                if len(sysex) > 1:
+                    messages.append((sysex[0], sysex))
+                continue
+
+            # continue assembling a fixed length message
+            if self.remaining:
+                available = min(self.remaining, length - index)
+                self.message.extend(data[index:index + available])
+                index += available
+                self.remaining -= available
+                if not self.remaining:
+                    messages.append((self.command, self.message))
+                continue
+
+            byte = data[index]
+            index += 1
+
+            if byte == PrivateConstants.START_SYSEX:
+                self.sysex = bytearray()
+                continue
+            # data bytes outside of a message are discarded
+            if byte < PrivateConstants.MSG_CMD_MIN:
+                continue
+
+            if byte < PrivateConstants.START_SYSEX:
+                command = byte & 0xf0
+                message = [byte & 0x0f]
+            else:
+                command = byte
+                message = []
+
+            data_length = self.data_lengths.get(command)
+            # unknown command bytes are discarded
+            if data_length is None:
+                continue
+            if not data_length:
+                messages.append((command, message))
+                continue
+
+            self.command = command
+            self.message = message
+            self.remaining = data_length
+
+        return messages
@@ -16,45 +16,194 @@ License along with this library; if not, write to the Free Software
 Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 """
 
+import time
+from array import array
 
-class PinData:
+
+class PinTable:
     """
-    Each analog and digital input pin is described by an instance of
-    this class. It contains both the last data value received and a potential
-    callback reference and the callback method type.
-    The callback method type default is a non-asyncio call,
-    but can be optionally be set to use yield from when required.
+    This class holds the state of all of the analog or all of the digital
+    pins of a board. The current value, the time of the last update and
+    the number of updates of each pin are kept in parallel array columns.
+    Callbacks are kept in a separate dictionary that only has entries
+    for pins with a callback.
+
+    Indexing the table returns a PinView, which provides the current_value,
+    cb and cb_type attributes of a single pin.
+
+    Only the event loop thread updates the table. Other threads may call
+    read, snapshot and versioned_snapshot at any time without going
+    through the event loop. The writer makes version odd while it updates
+    one pin, or all of the pins of a digital port report, and even again
+    when it is done, so a reader that sees the same even version before
+    and after copying the columns has a consistent snapshot.
     """
 
-    def __init__(self):
-        # current data value
-        self._current_value = 0
-        # callback reference
-        self._cb = None
-        # call back to be executed with "await" or direct call
-        # direct call is the default
-        self._cb_type = None
+    def __init__(self, size=0):
+        """
+        :param size: Number of pins
+        """
+        # current value of each pin
+        self.values = array('i', [0]) * size
+        # event loop time of each pin's last update
+        self.time_stamps = array('d', [0.0]) * size
+        # number of updates received for each pin
+        self.update_counts = array('q', [0]) * size
+        # pin number: [callback, callback type]
+        self.callbacks = {}
+        # incremented before and after every update
+        self.version = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, pin):
+        if not -len(self.values) <= pin < len(self.values):
+            raise IndexError('pin index out of range')
+        if pin < 0:
+            pin += len(self.values)
+        return PinView(self, pin)
+
+    def __iter__(self):
+        for pin in range(len(self.values)):
+            yield PinView(self, pin)
+
+    def resize(self, size):
+        """
+        Change the number of pins. Existing pin values and callbacks
+        are kept.
+
+        :param size: Number of pins
+        :returns: No return value.
+        """
+        self.version += 1
+        extra = size - len(self.values)
+        if extra > 0:
+            self.values.extend(array('i', [0]) * extra)
+            self.time_stamps.extend(array('d', [0.0]) * extra)
+            self.update_counts.extend(array('q', [0]) * extra)
+        elif extra < 0:
+            del self.values[size:]
+            del self.time_stamps[size:]
+            del self.update_counts[size:]
+            for pin in [pin for pin in self.callbacks if pin >= size]:
+                del self.callbacks[pin]
+        self.version += 1
+
+    def update(self, pin, value, time_stamp):
+        """
+        Store a new value for a pin
+
+        :param pin: Pin number
+        :param value: Pin value
+        :param time_stamp: Time of the update
+        :returns: No return value.
+        """
+        self.version += 1
+        self.values[pin] = value
+        self.time_stamps[pin] = time_stamp
+        self.update_counts[pin] += 1
+        self.version += 1
+
+    def read(self, pin):
+        """
+        Return the current value of a pin. This may be called from any
+        thread.
+
+        :param pin: Pin number
+        :returns: Pin value
+        """
+        return self.values[pin]
+
+    def set_callback(self, pin, cb, cb_type=None):
+        """
+        Set or, if cb and cb_type are None, remove the callback for a pin
+
+        :param pin: Pin number
+        :param cb: Callback reference
+        :param cb_type: Constants.CB_TYPE_DIRECT or
+                        Constants.CB_TYPE_ASYNCIO
+        :returns: No return value.
+        """
+        if cb is None and cb_type is None:
+            self.callbacks.pop(pin, None)
+        else:
+            self.callbacks[pin] = [cb, cb_type]
+
+    def snapshot(self):
+        """
+        This may be called from any thread.
+
+        :returns: A list of the current values of all pins
+        """
+        return self.versioned_snapshot()[1]
+
+    def versioned_snapshot(self):
+        """
+        Copy the values and time stamps of all pins as they were at a
+        single version of the table. This may be called from any thread.
+
+        :returns: A (version, values, time stamps) tuple
+        """
+        while True:
+            version = self.version
+            if not version & 1:
+                values = self.values.tolist()
+                time_stamps = self.time_stamps.tolist()
+                if version == self.version:
+                    return version, values, time_stamps
+            # an update is in progress on the loop thread
+            time.sleep(0)
+
+
+class PinView:
+    """
+    This class provides the attributes of one pin of a PinTable: the
+    last data value received, the time stamp and update count of that
+    value, and the callback reference and callback method type.
+    """
+    __slots__ = ('table', 'pin')
+
+    def __init__(self, table, pin):
+        self.table = table
+        self.pin = pin
 
     @property
     def current_value(self):
-        return self._current_value
+        return self.table.values[self.pin]
 
     @current_value.setter
     def current_value(self, value):
-        self._current_value = value
+        self.table.version += 1
+        self.table.values[self.pin] = value
+        self.table.version += 1
+
+    @property
+    def time_stamp(self):
+        return self.table.time_stamps[self.pin]
+
+    @property
+    def update_count(self):
+        return self.table.update_counts[self.pin]
 
     @property
     def cb(self):
-        return self._cb
+        callback = self.table.callbacks.get(self.pin)
+        if callback:
+            return callback[0]
+        return None
 
     @cb.setter
     def cb(self, value):
-        self._cb = value
+        self.table.set_callback(self.pin, value, self.cb_type)
 
     @property
     def cb_type(self):
-        return self._cb_type
+        callback = self.table.callbacks.get(self.pin)
+        if callback:
+            return callback[1]
+        return None
 
     @cb_type.setter
     def cb_type(self, value):
-        self._cb_type = value
+        self.table.set_callback(self.pin, self.cb, value)
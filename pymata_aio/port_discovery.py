@@ -0,0 +1,153 @@
+"""
+Copyright (c) 2016 Alan Yorinks All rights reserved.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU  General Public
+License as published by the Free Software Foundation; either
+version 3 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""
+
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+from serial.tools import list_ports
+
+from pymata_aio.firmata_parser import FirmataParser
+from pymata_aio.private_constants import PrivateConstants
+
+# how long a single serial read waits for data while probing
+PROBE_READ_TIMEOUT = 0.1
+
+# USB vendor IDs of Arduino boards and of the USB serial chips used on
+# Arduino compatible boards. Only ports with one of these vendor IDs are
+# probed by default, so that other serial devices are not sent queries.
+FIRMATA_USB_VIDS = {0x2341,  # Arduino
+                    0x2a03,  # Arduino (arduino.org)
+                    0x1b4f,  # SparkFun
+                    0x239a,  # Adafruit
+                    0x0403,  # FTDI
+                    0x10c4,  # Silicon Labs CP210x
+                    0x1a86,  # WCH CH340
+                    0x067b}  # Prolific
+
+
+def list_serial_ports(vids=FIRMATA_USB_VIDS):
+    """
+    Enumerate the serial ports present on this machine.
+
+    :param vids: USB vendor IDs of the ports to list. None lists every
+                 serial port, including ports that are not USB devices.
+    :returns: A list of port names
+    """
+    return [port_info[0] for port_info in list_ports.comports()
+            if vids is None or usb_vendor_id(port_info) in vids]
+
+
+def usb_vendor_id(port_info):
+    """
+    Find the USB vendor ID of a port. Older pyserial versions only
+    report it in the hardware ID string, e.g. "USB VID:PID=2341:0043".
+
+    :param port_info: Port entry returned by list_ports.comports()
+    :returns: Vendor ID or None if the port is not a USB device
+    """
+    vid = getattr(port_info, 'vid', None)
+    if vid is not None:
+        return vid
+    match = re.search(r'VID:PID=([0-9a-fA-F]{4})', port_info[2] or '')
+    if not match:
+        return None
+    return int(match.group(1), 16)
+
+
+def probe_port(port, speed=57600, reset_wait=2, timeout=2):
+    """
+    Open a serial port and check that a Firmata board answers a
+    firmware query on it. Queries are repeated every
+    READY_PROBE_INTERVAL seconds until the board answers, so that boards
+    that reset when the port is opened are detected as soon as they
+    are ready.
+
+    :param port: Serial port name
+    :param speed: Baud rate
+    :param reset_wait: Time to allow for the board to reset
+    :param timeout: Time to wait for an answer after reset_wait
+    :returns: The firmware ID string or None if no Firmata board answered
+    """
+    try:
+        serial_port = serial.Serial(port, speed, timeout=PROBE_READ_TIMEOUT,
+                                    writeTimeout=1)
+    except (serial.SerialException, OSError, ValueError):
+        return None
+
+    parser = FirmataParser()
+    query = bytes((PrivateConstants.START_SYSEX,
+                   PrivateConstants.REPORT_FIRMWARE,
+                   PrivateConstants.END_SYSEX))
+    deadline = time.time() + reset_wait + timeout
+    next_query = 0
+    try:
+        while time.time() < deadline:
+            if time.time() >= next_query:
+                serial_port.write(query)
+                next_query = time.time() + \
+                    PrivateConstants.READY_PROBE_INTERVAL
+            data = serial_port.read(max(1, serial_port.inWaiting()))
+            for command, message in parser.feed(data):
+                if command == PrivateConstants.REPORT_FIRMWARE:
+                    return firmware_id(message)
+    except (serial.SerialException, OSError):
+        return None
+    finally:
+        serial_port.close()
+    return None
+
+
+def discover_boards(ports=None, speed=57600, reset_wait=2, timeout=2):
+    """
+    Probe serial ports concurrently for Firmata boards.
+
+    :param ports: Port names to probe. By default the ports returned by
+                  list_serial_ports() are probed.
+    :param speed: Baud rate
+    :param reset_wait: Time to allow for each board to reset
+    :param timeout: Time to wait for an answer after reset_wait
+    :returns: A list of (port, firmware ID) tuples, one for each port
+              that answered, in port order
+    """
+    if ports is None:
+        ports = list_serial_ports()
+    ports = list(ports)
+    if not ports:
+        return []
+
+    with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+        firmware_ids = list(executor.map(
+            lambda port: probe_port(port, speed, reset_wait, timeout), ports))
+
+    return [(port, firmware) for port, firmware in zip(ports, firmware_ids)
+            if firmware]
+
+
+def firmware_id(sysex_data):
+    """
+    Convert a REPORT_FIRMWARE sysex message to a firmware ID string
+    in the same format as PymataCore.get_firmware_version(),
+    e.g. "2.5 StandardFirmata.ino"
+
+    :param sysex_data: [REPORT_FIRMWARE, major, minor, name..., END_SYSEX]
+    :returns: Firmware ID string
+    """
+    name = ''.join(chr(e) for e in sysex_data[3:-1] if e)
+    return str(sysex_data[1]) + '.' + str(sysex_data[2]) + ' ' + name
@@ -73,6 +73,10 @@ class PrivateConstants:
     # reserved for PyMata
     PYMATA_VERSION = "2.15"
 
+    # interval in seconds between firmware queries while waiting for
+    # the board to become ready at start up
+    READY_PROBE_INTERVAL = 0.1
+
     # each byte represents a digital port
     #  and its value contains the current port settings
     DIGITAL_OUTPUT_PORT_PINS = [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
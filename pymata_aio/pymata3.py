@@ -17,10 +17,16 @@ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 """
 
 import asyncio
+import logging
+import sys
+import threading
+import time as _time
 
 try:
+    from constants import Constants
     from pymata_core import PymataCore
 except ImportError:
+    from .constants import Constants
     from .pymata_core import PymataCore
 
 
@@ -32,7 +38,9 @@ class PyMata3:
     """
 
     def __init__(self, arduino_wait=2, sleep_tune=0.0001, log_output=False, com_port=None,
-                 ip_address=None, ip_port=2000, ip_handshake='*HELLO*'):
+                 ip_address=None, ip_port=2000, ip_handshake='*HELLO*',
+                 event_driven_serial=None, transport=None, record_file=None,
+                 suppress_redundant_writes=False, background_loop=False):
         """
         Constructor for the PyMata3 API
         If log_output is set to True, a log file called 'pymata_log'
@@ -50,16 +58,63 @@ class PyMata3:
         :param ip_address: If using a WiFly module, set its address here
         :param ip_port: Port to used with ip_address
         :param ip_handshake: Connectivity handshake string sent by IP device
+        :param event_driven_serial: If True, serial reads are woken by the
+                                    event loop when data arrives instead of
+                                    polling. None selects it on Linux.
+        :param transport: Optional object that provides read, read_bytes
+                          and write coroutines, such as PymataSimulator,
+                          used in place of a serial port or IP connection.
+        :param record_file: Optional path of a file in which all data
+                            exchanged with the board is recorded for
+                            playback with PymataReplay.
+        :param suppress_redundant_writes: If True, writes that would send
+                                          the value last sent to a pin or
+                                          port are skipped unless
+                                          force=True is passed.
+        :param background_loop: If True, the event loop runs continuously
+                                on a dedicated thread and each call is
+                                handed to it with run_coroutine_threadsafe.
+                                Callbacks are then called on that thread,
+                                even while the application is not inside
+                                a PyMata3 call. A PyMata3 method that only
+                                sends a command, such as digital_write, is
+                                scheduled on the loop when called from a
+                                callback and returns at once. A method
+                                that returns a value, such as
+                                get_pin_state, cannot wait for its reply
+                                on the loop thread and raises
+                                RuntimeError there. Callback code should
+                                use the PymataCore coroutine, self.core,
+                                instead.
 
         :returns: None
         """
         self.log_out = log_output
-        self.loop = asyncio.get_event_loop()
+        self.background_loop = background_loop
+        self.loop_thread = None
+        # exception that stopped the background loop thread
+        self.loop_exit = None
+        # calls waiting for the background loop thread
+        self._loop_calls = set()
+        if background_loop:
+            self.loop = asyncio.new_event_loop()
+            self.loop_thread = threading.Thread(target=self._run_loop,
+                                                name='pymata_aio loop',
+                                                daemon=True)
+            self.loop_thread.start()
+        else:
+            self.loop = asyncio.get_event_loop()
 
         self.sleep_tune = sleep_tune
         self.core = PymataCore(arduino_wait, self.sleep_tune, log_output,
-                               com_port, ip_address, ip_port, ip_handshake)
-        self.core.start()
+                               com_port, ip_address, ip_port, ip_handshake,
+                               event_driven_serial, transport=transport,
+                               record_file=record_file, loop=self.loop,
+                               suppress_redundant_writes=suppress_redundant_writes)
+        if background_loop:
+            self._run(self.core.start_aio())
+        else:
+            self.core.start()
         self.sleep(1)
 
     def analog_read(self, pin):
@@ -67,58 +122,102 @@ class PyMata3:
         Retrieve the last data update for the specified analog pin.
         It is intended for a polling application.
 
+        The value is read directly without running the event loop, so
+        this may be called from any thread.
+
         :param pin: Analog pin number (ex. A2 is specified as 2)
         :returns: Last value reported for the analog pin
         """
-        task = asyncio.ensure_future(self.core.analog_read(pin))
-        value = self.loop.run_until_complete(task)
-        return value
+        return self.core.analog_pins.read(pin)
 
-    def analog_write(self, pin, value):
+    def analog_snapshot(self):
+        """
+        Retrieve the last data update for every analog pin as a
+        consistent snapshot. This may be called from any thread.
+
+        :returns: A (version, values, time stamps) tuple
+        """
+        return self.core.analog_snapshot()
+
+    def analog_write(self, pin, value, force=False):
         """
         Set the selected PWM pin to the specified value.
 
         :param pin: PWM pin number
         :param value:  Set the selected pin to the specified
                        value. 0-0x4000 (14 bits)
+        :param force: Send the value even if it is the last value sent
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.analog_write(pin, value))
-        self.loop.run_until_complete(task)
+        self._run(self.core.analog_write(pin, value, force))
 
     def digital_read(self, pin):
         """
         Retrieve the last data update for the specified digital pin.
         It is intended for a polling application.
 
+        The value is read directly without running the event loop, so
+        this may be called from any thread.
+
         :param pin: Digital pin number
         :returns: Last value reported for the digital pin
         """
-        task = asyncio.ensure_future(self.core.digital_read(pin))
-        value = self.loop.run_until_complete(task)
-        return value
+        return self.core.digital_pins.read(pin)
+
+    def digital_snapshot(self):
+        """
+        Retrieve the last data update for every digital pin as a
+        consistent snapshot. This may be called from any thread.
+
+        :returns: A (version, values, time stamps) tuple
+        """
+        return self.core.digital_snapshot()
 
-    def digital_pin_write(self, pin, value=0):
+    def digital_pin_write(self, pin, value=0, force=False):
         """
         Set the specified digital input pin to the provided value
 
         :param pin: Digital pin to be set
         :param value: 0 or 1
+        :param force: Send the value even if it is the last value sent
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.digital_pin_write(pin, value))
-        self.loop.run_until_complete(task)
+        self._run(self.core.digital_pin_write(pin, value, force))
 
-    def digital_write(self, pin, value=0):
+    def digital_write(self, pin, value=0, force=False):
         """
         Set the specified digital input pin to the provided value
 
         :param pin: Digital pin to be set
         :param value: 0 or 1
+        :param force: Send the value even if it is the last value sent
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.digital_write(pin, value))
-        self.loop.run_until_complete(task)
+        self._run(self.core.digital_write(pin, value, force))
+
+    def digital_port_write(self, port, mask, values, force=False):
+        """
+        Set several pins of one digital port with a single message
+
+        :param port: Port number. Port 0 is pins 0-7, port 1 is pins 8-15...
+        :param mask: Bit mask of the port pins to change
+        :param values: Bit values of the port pins selected by mask
+        :param force: Send the value even if it is the last value sent
+        :returns: No return value
+        """
+        self._run(self.core.digital_port_write(port, mask,
+                                               values,
+                                               force))
+
+    def digital_write_many(self, pin_values, force=False):
+        """
+        Set several digital pins with one message per port affected
+
+        :param pin_values: Dictionary of pin number: pin value
+        :param force: Send the value even if it is the last value sent
+        :returns: No return value
+        """
+        self._run(self.core.digital_write_many(pin_values, force))
 
     def disable_analog_reporting(self, pin):
         """
@@ -127,8 +226,7 @@ class PyMata3:
         :param pin: Analog pin number. For example for A0, the number is 0.
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.disable_analog_reporting(pin))
-        self.loop.run_until_complete(task)
+        self._run(self.core.disable_analog_reporting(pin))
 
     def disable_digital_reporting(self, pin):
         """
@@ -138,8 +236,7 @@ class PyMata3:
         :param pin: Pin and all pins for this port
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.disable_digital_reporting(pin))
-        self.loop.run_until_complete(task)
+        self._run(self.core.disable_digital_reporting(pin))
 
     def encoder_config(self, pin_a, pin_b, cb=None, cb_type=None,
                        hall_encoder=False):
@@ -161,10 +258,9 @@ class PyMata3:
                              hall encoder support support.
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.encoder_config(pin_a, pin_b,
-                                                              cb, cb_type,
-                                                              hall_encoder))
-        self.loop.run_until_complete(task)
+        self._run(self.core.encoder_config(pin_a, pin_b,
+                                           cb, cb_type,
+                                           hall_encoder))
 
     def encoder_read(self, pin):
         """
@@ -175,10 +271,11 @@ class PyMata3:
         :returns: encoder data value
         """
         try:
-            task = asyncio.ensure_future(self.core.encoder_read(pin))
-            value = self.loop.run_until_complete(task)
+            value = self._run_result(self.core.encoder_read(pin))
             return value
         except RuntimeError:
+            if threading.current_thread() is self.loop_thread:
+                raise
             self.shutdown()
 
     def enable_analog_reporting(self, pin):
@@ -188,8 +285,7 @@ class PyMata3:
         :param pin: Analog pin number. For example for A0, the number is 0.
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.enable_analog_reporting(pin))
-        self.loop.run_until_complete(task)
+        self._run(self.core.enable_analog_reporting(pin))
 
     def enable_digital_reporting(self, pin):
         """
@@ -200,20 +296,19 @@ class PyMata3:
         :param pin: Pin and all pins for this port
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.enable_digital_reporting(pin))
-        self.loop.run_until_complete(task)
+        self._run(self.core.enable_digital_reporting(pin))
 
-    def extended_analog(self, pin, data):
+    def extended_analog(self, pin, data, force=False):
         """
         This method will send an extended-data analog write command
         to the selected pin..
 
         :param pin: 0 - 127
         :param data: 0 - 0-0x4000 (14 bits)
+        :param force: Send the value even if it is the last value sent
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.extended_analog(pin, data))
-        self.loop.run_until_complete(task)
+        self._run(self.core.extended_analog(pin, data, force))
 
     def get_analog_latch_data(self, pin):
         """
@@ -228,8 +323,7 @@ class PyMata3:
         :returns:  [latched_state, threshold_type, threshold_value,
                     latched_data, time_stamp]
         """
-        task = asyncio.ensure_future(self.core.get_analog_latch_data(pin))
-        l_data = self.loop.run_until_complete(task)
+        l_data = self._run_result(self.core.get_analog_latch_data(pin))
         return l_data
 
     def get_analog_map(self, cb=None):
@@ -239,8 +333,7 @@ class PyMata3:
         :param cb: Optional callback reference
         :returns: An analog map response or None if a timeout occurs
         """
-        task = asyncio.ensure_future(self.core.get_analog_map())
-        report = self.loop.run_until_complete(task)
+        report = self._run_result(self.core.get_analog_map())
         if cb:
             cb(report)
         else:
@@ -256,8 +349,7 @@ class PyMata3:
         :param cb: Optional callback reference to receive a raw report
         :returns: capability report
         """
-        task = asyncio.ensure_future(self.core.get_capability_report())
-        report = self.loop.run_until_complete(task)
+        report = self._run_result(self.core.get_capability_report())
         if raw:
             if cb:
                 cb(report)
@@ -282,8 +374,7 @@ class PyMata3:
         :returns:  [latched_state, threshold_type, threshold_value,
                     latched_data, time_stamp]
         """
-        task = asyncio.ensure_future(self.core.get_digital_latch_data(pin))
-        l_data = self.loop.run_until_complete(task)
+        l_data = self._run_result(self.core.get_digital_latch_data(pin))
         return l_data
 
     def get_firmware_version(self, cb=None):
@@ -293,8 +384,7 @@ class PyMata3:
         :param cb: Reference to a callback function
         :returns:If no callback is specified, the firmware version
         """
-        task = asyncio.ensure_future(self.core.get_firmware_version())
-        version = self.loop.run_until_complete(task)
+        version = self._run_result(self.core.get_firmware_version())
         if cb:
             cb(version)
         else:
@@ -307,8 +397,7 @@ class PyMata3:
         :param cb: Optional callback reference.
         :returns:If no callback is specified, the firmware version
         """
-        task = asyncio.ensure_future(self.core.get_protocol_version())
-        version = self.loop.run_until_complete(task)
+        version = self._run_result(self.core.get_protocol_version())
 
         if cb:
             cb(version)
@@ -323,22 +412,50 @@ class PyMata3:
         :param cb: optional callback reference
         :returns: pin state report
         """
-        task = asyncio.ensure_future(self.core.get_pin_state(pin))
-        report = self.loop.run_until_complete(task)
+        report = self._run_result(self.core.get_pin_state(pin))
 
         if cb:
             cb(report)
         else:
             return report
 
+    def get_pin_states(self, pins, cb=None):
+        """
+        This method retrieves pin state reports for a group of pins.
+        All of the queries are sent at once.
+
+        :param pins: An iterable of pin numbers
+        :param cb: optional callback reference
+        :returns: A dictionary of pin number to pin state report
+        """
+        reports = self._run_result(self.core.get_pin_states(pins))
+
+        if cb:
+            cb(reports)
+        else:
+            return reports
+
+    def get_all_pin_states(self, cb=None):
+        """
+        This method retrieves a pin state report for every digital pin.
+
+        :param cb: optional callback reference
+        :returns: A dictionary of pin number to pin state report
+        """
+        reports = self._run_result(self.core.get_all_pin_states())
+
+        if cb:
+            cb(reports)
+        else:
+            return reports
+
     def get_pymata_version(self):
         """
         This method retrieves the PyMata version number
 
         :returns: PyMata version number.
         """
-        task = asyncio.ensure_future(self.core.get_pymata_version())
-        self.loop.run_until_complete(task)
+        self._run(self.core.get_pymata_version())
 
     def i2c_config(self, read_delay_time=0):
         """
@@ -347,8 +464,25 @@ class PyMata3:
         :param read_delay_time: firmata i2c delay time
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.i2c_config(read_delay_time))
-        self.loop.run_until_complete(task)
+        self._run(self.core.i2c_config(read_delay_time))
+
+    def i2c_read(self, address, register, number_of_bytes,
+                 read_type=Constants.I2C_READ, timeout=None):
+        """
+        Read an i2c device and wait for the reply to this request.
+
+        :param address: i2c device address
+        :param register: register number (can be set to zero)
+        :param number_of_bytes: number of bytes to read
+        :param read_type: I2C_READ. I2C_RESTART_TX may be OR'ed when
+                          required
+        :param timeout: Seconds to wait for the reply. None selects the
+                        default query timeout.
+        :returns: List of the bytes read or None if a timeout occurs
+        """
+        return self._run_result(self.core.i2c_read(address, register,
+                                                   number_of_bytes,
+                                                   read_type, timeout))
 
     def i2c_read_data(self, address):
         """
@@ -359,8 +493,7 @@ class PyMata3:
         :param address: i2c
         :returns: last data read or None if no data is present.
         """
-        task = asyncio.ensure_future(self.core.i2c_read_data(address))
-        value = self.loop.run_until_complete(task)
+        value = self._run_result(self.core.i2c_read_data(address))
         return value
 
     def i2c_read_request(self, address, register, number_of_bytes, read_type,
@@ -387,12 +520,11 @@ class PyMata3:
                         Constants.CB_TYPE_ASYNCIO = asyncio coroutine
         :returns: No return value        """
 
-        task = asyncio.ensure_future(self.core.i2c_read_request(address, register,
-                                                                number_of_bytes,
-                                                                read_type,
-                                                                cb,
-                                                                cb_type))
-        self.loop.run_until_complete(task)
+        self._run(self.core.i2c_read_request(address, register,
+                                             number_of_bytes,
+                                             read_type,
+                                             cb,
+                                             cb_type))
 
     def i2c_write_request(self, address, args):
         """
@@ -403,8 +535,7 @@ class PyMata3:
                      passed in as a list.
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.i2c_write_request(address, args))
-        self.loop.run_until_complete(task)
+        self._run(self.core.i2c_write_request(address, args))
 
     def keep_alive(self, period=1, margin=.3):
         """
@@ -417,7 +548,11 @@ class PyMata3:
         :param margin: Safety margin to assure keepalives are sent before period expires. Range is 0.1 to 0.9
         :returns: No return value
         """
-        asyncio.ensure_future(self.core.keep_alive(period, margin))
+        if self.background_loop:
+            asyncio.run_coroutine_threadsafe(
+                self.core.keep_alive(period, margin), self.loop)
+        else:
+            asyncio.ensure_future(self.core.keep_alive(period, margin))
 
     def play_tone(self, pin, tone_command, frequency, duration=None):
         """
@@ -435,9 +570,7 @@ class PyMata3:
         :param duration: Duration of tone in milliseconds
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.play_tone(pin, tone_command,
-                                                         frequency, duration))
-        self.loop.run_until_complete(task)
+        self._run(self.core.play_tone(pin, tone_command, frequency, duration))
 
     def send_reset(self):
         """
@@ -445,8 +578,7 @@ class PyMata3:
 
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.send_reset())
-        self.loop.run_until_complete(task)
+        self._run(self.core.send_reset())
 
     def servo_config(self, pin, min_pulse=544, max_pulse=2400):
         """
@@ -457,9 +589,26 @@ class PyMata3:
         :param max_pulse: Maximum pulse width
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.servo_config(pin, min_pulse,
-                                                            max_pulse))
-        self.loop.run_until_complete(task)
+        self._run(self.core.servo_config(pin, min_pulse, max_pulse))
+
+    def set_analog_filter(self, pin, deadband=None, deadband_percent=None,
+                          min_interval=None):
+        """
+        Filter the reports for an analog pin before its callback and latch
+        are processed. Calling this method with no filter parameters
+        removes the filter.
+
+        :param pin: Analog pin number (ex. A2 is specified as 2)
+        :param deadband: Values within this distance of the last value
+                         passed on are dropped. 0 passes on changes only.
+        :param deadband_percent: Deadband as a percentage of the 10 bit
+                                 full scale (1023)
+        :param min_interval: Minimum number of seconds between reports
+                             passed on
+        :returns: No return value
+        """
+        self._run(self.core.set_analog_filter(
+            pin, deadband, deadband_percent, min_interval))
 
     def set_analog_latch(self, pin, threshold_type, threshold_value,
                          cb=None, cb_type=None):
@@ -480,10 +629,21 @@ class PyMata3:
         :returns: True if successful, False if parameter data is invalid
         """
 
-        task = asyncio.ensure_future(self.core.set_analog_latch(pin, threshold_type, threshold_value, cb, cb_type))
-        result = self.loop.run_until_complete(task)
+        result = self._run_result(self.core.set_analog_latch(pin, threshold_type, threshold_value, cb, cb_type))
         return result
 
+    def set_digital_port_callback(self, port, cb=None):
+        """
+        Register a callback for a whole digital input port. It is called
+        with [port, port value, mask of the changed pins] once for each
+        report in which at least one pin of the port changed.
+
+        :param port: Port number. Port 0 is pins 0-7, port 1 is pins 8-15...
+        :param cb: callback function. None removes the callback.
+        :returns: No return value
+        """
+        self._run(self.core.set_digital_port_callback(port, cb))
+
     def set_digital_latch(self, pin, threshold_value, cb=None, cb_type=None):
         """
         This method "arms" a digital pin for its data to be latched and saved
@@ -499,10 +659,22 @@ class PyMata3:
                         Constants.CB_TYPE_ASYNCIO = asyncio coroutine
         :returns: True if successful, False if parameter data is invalid
         """
-        task = asyncio.ensure_future(self.core.set_digital_latch(pin, threshold_value, cb, cb_type))
-        result = self.loop.run_until_complete(task)
+        result = self._run_result(self.core.set_digital_latch(pin, threshold_value, cb, cb_type))
         return result
 
+    def set_output_priority(self, pin, priority=None):
+        """
+        Set the priority class of writes to an output pin. Writes to a
+        PRIORITY_SAFETY pin are written at once, ahead of queued bulk
+        traffic. This only takes effect when write batching is enabled.
+
+        :param pin: Output pin number
+        :param priority: Constants.PRIORITY_SAFETY, PRIORITY_CONTROL or
+                         PRIORITY_BULK. None restores the default.
+        :returns: No return value
+        """
+        self._run(self.core.set_output_priority(pin, priority))
+
     def set_pin_mode(self, pin_number, pin_state, callback=None, cb_type=None):
         """
         This method sets the  pin mode for the specified pin.
@@ -516,8 +688,7 @@ class PyMata3:
                         Constants.CB_TYPE_ASYNCIO = asyncio coroutine
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.set_pin_mode(pin_number, pin_state, callback, cb_type))
-        self.loop.run_until_complete(task)
+        self._run(self.core.set_pin_mode(pin_number, pin_state, callback, cb_type))
 
     def set_sampling_interval(self, interval):
         """
@@ -526,8 +697,7 @@ class PyMata3:
         :param interval: time in milliseconds
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.set_sampling_interval(interval))
-        self.loop.run_until_complete(task)
+        self._run(self.core.set_sampling_interval(interval))
 
     def sleep(self, time):
         """
@@ -537,9 +707,12 @@ class PyMata3:
         :param time: time in seconds
         :returns: No return value
         """
+        if self.background_loop:
+            # the loop keeps running on its own thread
+            _time.sleep(time)
+            return
         try:
-            task = asyncio.ensure_future(self.core.sleep(time))
-            self.loop.run_until_complete(task)
+            self._run(self.core.sleep(time))
 
         except asyncio.CancelledError:
             pass
@@ -552,8 +725,12 @@ class PyMata3:
 
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.shutdown())
-        self.loop.run_until_complete(task)
+        if self.background_loop:
+            self._stop_loop()
+            if threading.current_thread() is not self.loop_thread:
+                sys.exit(0)
+            return
+        self._run(self.core.shutdown())
 
     def sonar_data_retrieve(self, trigger_pin):
         """
@@ -566,8 +743,7 @@ class PyMata3:
         :param trigger_pin: trigger pin specified in sonar_config
         :returns: active_sonar_map
         """
-        task = asyncio.ensure_future(self.core.sonar_data_retrieve(trigger_pin))
-        sonar_data = self.loop.run_until_complete(task)
+        sonar_data = self._run_result(self.core.sonar_data_retrieve(trigger_pin))
         return sonar_data
 
     # noinspection PyUnusedLocal
@@ -594,11 +770,10 @@ class PyMata3:
         :param cb_type: direct call or asyncio yield from
         :returns: No return value
         """
-        task = asyncio.ensure_future(self.core.sonar_config(trigger_pin,
-                                                            echo_pin, cb,
-                                                            ping_interval,
-                                                            max_distance, cb_type))
-        self.loop.run_until_complete(task)
+        self._run(self.core.sonar_config(trigger_pin,
+                                         echo_pin, cb,
+                                         ping_interval,
+                                         max_distance, cb_type))
 
     def stepper_config(self, steps_per_revolution, stepper_pins):
         """
@@ -610,9 +785,7 @@ class PyMata3:
         :returns: No return value
 
         """
-        task = asyncio.ensure_future(self.core.stepper_config(steps_per_revolution,
-                                                              stepper_pins))
-        self.loop.run_until_complete(task)
+        self._run(self.core.stepper_config(steps_per_revolution, stepper_pins))
 
     def stepper_step(self, motor_speed, number_of_steps):
         """
@@ -623,9 +796,7 @@ class PyMata3:
         :param number_of_steps: 14 bits for number of steps & direction
                                 positive is forward, negative is reverse
         """
-        task = asyncio.ensure_future(self.core.stepper_step(motor_speed,
-                                                            number_of_steps))
-        self.loop.run_until_complete(task)
+        self._run(self.core.stepper_step(motor_speed, number_of_steps))
 
     def pixy_init(self, max_blocks=5, cb=None, cb_type=None):
         """
@@ -638,8 +809,7 @@ class PyMata3:
         :param max_blocks: Maximum number of Pixy blocks to report when many signatures are found.
         :returns: No return value.
         """
-        task = asyncio.ensure_future(self.core.pixy_init(max_blocks, cb, cb_type))
-        self.loop.run_until_complete(task)
+        self._run(self.core.pixy_init(max_blocks, cb, cb_type))
 
     def pixy_get_blocks(self):
         """
@@ -658,8 +828,7 @@ class PyMata3:
         :param s1: value 0 to 1000
         :returns: No return value.
         """
-        task = asyncio.ensure_future(self.core.pixy_set_servos(s0, s1))
-        self.loop.run_until_complete(task)
+        self._run(self.core.pixy_set_servos(s0, s1))
 
     def pixy_set_brightness(self, brightness):
         """
@@ -669,8 +838,7 @@ class PyMata3:
         :param brightness: range between 0 and 255 with 255 being the brightest setting
         :returns: No return value.
         """
-        task = asyncio.ensure_future(self.core.pixy_set_brightness(brightness))
-        self.loop.run_until_complete(task)
+        self._run(self.core.pixy_set_brightness(brightness))
 
     def pixy_set_led(self, r, g, b):
         """
@@ -682,5 +850,105 @@ class PyMata3:
         :param b: blue range between 0 and 255
         :returns: No return value.
         """
-        task = asyncio.ensure_future(self.core.pixy_set_led(r, g, b))
-        self.loop.run_until_complete(task)
+        self._run(self.core.pixy_set_led(r, g, b))
+
+    def _run(self, coroutine):
+        """
+        This is a private utility method.
+        It runs a PymataCore coroutine to completion, either on the
+        background loop thread or on the calling thread.
+
+        When called on the background loop thread, for example from a
+        callback, waiting would stop the loop for good, so the coroutine
+        is scheduled and its Task is returned. Wrappers that return a
+        value use _run_result instead.
+
+        :param coroutine: PymataCore coroutine
+        :returns: The coroutine return value, or a Task on the background
+                  loop thread
+        """
+        if self.background_loop:
+            if threading.current_thread() is self.loop_thread:
+                return self.loop.create_task(coroutine)
+            if self.loop_exit is not None:
+                coroutine.close()
+                raise self.loop_exit
+            future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+            self._loop_calls.add(future)
+            try:
+                return future.result()
+            finally:
+                self._loop_calls.discard(future)
+        task = asyncio.ensure_future(coroutine)
+        return self.loop.run_until_complete(task)
+
+    def _run_result(self, coroutine):
+        """
+        This is a private utility method.
+        It runs a PymataCore coroutine to completion like _run, for a
+        wrapper that returns the coroutine return value. That value
+        cannot be waited for on the background loop thread, so a
+        RuntimeError naming the coroutine to use is raised there.
+
+        :param coroutine: PymataCore coroutine
+        :returns: The coroutine return value
+        """
+        if self.background_loop and \
+                threading.current_thread() is self.loop_thread:
+            name = coroutine.__qualname__
+            coroutine.close()
+            raise RuntimeError(name.split('.')[-1] + '() cannot wait for a '
+                               'result on the event loop thread, for '
+                               'example in a callback. Use the ' + name +
+                               '() coroutine instead, with await or '
+                               'asyncio.ensure_future.')
+        return self._run(coroutine)
+
+    def _run_loop(self):
+        """
+        This is a private utility method.
+        It is the target of the background loop thread.
+
+        :returns: No return value.
+        """
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        except BaseException as ex:
+            # for example SystemExit when a board fails with exit_on_error
+            self.loop_exit = ex
+        finally:
+            if self.loop_exit is None:
+                self.loop_exit = RuntimeError('PyMata3 event loop stopped')
+            # calls that can no longer complete are given the exception
+            for future in list(self._loop_calls):
+                if not future.done():
+                    try:
+                        future.set_exception(self.loop_exit)
+                    except Exception:
+                        pass
+            self.loop.close()
+
+    def _stop_loop(self):
+        """
+        This is a private utility method.
+        It closes the board and stops the background loop thread.
+
+        :returns: No return value.
+        """
+        if self.log_out:
+            logging.info('Shutting down ...')
+        else:
+            print('Shutting down ...')
+        if threading.current_thread() is self.loop_thread:
+            # called from a callback - stop once the board is closed
+            task = self.loop.create_task(self.core.close())
+            task.add_done_callback(lambda task: self.loop.stop())
+            return
+        if self.loop_exit is None:
+            try:
+                self._run(self.core.close())
+            except Exception:
+                pass
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
@@ -17,16 +17,19 @@ Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 """
 
 import asyncio
-import glob
 import logging
 import sys
 import time
 
 import serial
 
+from pymata_aio.board_cache import BoardCache
+from pymata_aio import port_discovery
 from pymata_aio.constants import Constants
-from pymata_aio.pin_data import PinData
+from pymata_aio.firmata_parser import FirmataParser
+from pymata_aio.pin_data import PinTable
 from pymata_aio.private_constants import PrivateConstants
+from pymata_aio.pymata_recorder import PymataRecorder
 from pymata_aio.pymata_serial import PymataSerial
 from pymata_aio.pymata_socket import PymataSocket
 
@@ -45,7 +48,12 @@ class PymataCore:
 
     def __init__(self, arduino_wait=2, sleep_tune=0.0001, log_output=False,
                  com_port=None, ip_address=None, ip_port=2000,
-                 ip_handshake='*HELLO*'):
+                 ip_handshake='*HELLO*', event_driven_serial=None,
+                 write_batch_window=None, query_timeout=2, cache_file=None,
+                 transport=None, record_file=None, loop=None,
+                 exit_on_error=True, suppress_redundant_writes=False,
+                 coalesce_outputs=False, max_output_rate=None,
+                 bulk_write_limit=None, probe_ports=True):
         """
         This is the "constructor" method for the PymataCore class.
 
@@ -55,8 +63,12 @@ class PymataCore:
         will be redirected to the log with no output appearing on the console.
 
 
-        :param arduino_wait: Amount of time to wait for Arduino to reset.
-                             UNO takes 2 seconds, Leonardo can be zero
+        :param arduino_wait: Amount of time to allow for Arduino to reset.
+                             UNO takes 2 seconds, Leonardo can be zero.
+                             The board is probed with firmware queries
+                             during start up and is used as soon as it
+                             answers. Start up fails if it has not answered
+                             within arduino_wait plus query_timeout seconds.
         :param sleep_tune: This parameter sets the amount of time PyMata core
                            uses to set asyncio.sleep
         :param log_output: If false, all output goes to console, else output
@@ -66,6 +78,74 @@ class PymataCore:
         :param ip_address: If using a WiFly module, set its address here
         :param ip_port: Port to used with ip_address
         :param ip_handshake: Connectivity handshake string sent by IP device
+        :param event_driven_serial: If True, serial reads are woken by the
+                                    event loop when data arrives instead of
+                                    polling. None selects it on Linux.
+        :param write_batch_window: None sends every command as soon as it
+                                   is issued. 0 batches all commands issued
+                                   within one event loop pass into a single
+                                   write. A positive value batches commands
+                                   issued within that many microseconds.
+        :param query_timeout: Default number of seconds to wait for a reply
+                              to a firmware, protocol, capability, analog
+                              map or pin state query.
+        :param cache_file: Optional path of a JSON file used to cache the
+                           board description. Start up still waits for
+                           the board to answer a firmware query. When the
+                           port and firmware ID are found in the cache, the
+                           pin tables are built from the cache without the
+                           analog map query, and are verified against the
+                           board in the background.
+        :param transport: Optional object that provides read, read_bytes
+                          and write coroutines, such as PymataSimulator.
+                          When given, it is used in place of a serial port
+                          or IP connection.
+        :param record_file: Optional path of a file in which every chunk
+                            of data received from and sent to the board is
+                            recorded. The recording can be played back with
+                            the PymataReplay transport.
+        :param loop: Optional event loop. Defaults to
+                     asyncio.get_event_loop().
+        :param exit_on_error: If True, the process exits when the board
+                              cannot be opened or stops responding. If
+                              False, start up errors are raised as
+                              exceptions and a failed connection is closed
+                              with close(), leaving the event loop and any
+                              other boards running.
+        :param suppress_redundant_writes: If True, analog_write,
+                                          extended_analog, digital_write,
+                                          digital_pin_write and the port
+                                          writes are skipped when they
+                                          would send the value last sent
+                                          to the pin or port. Pass
+                                          force=True to send anyway.
+        :param coalesce_outputs: If True, an analog_write or
+                                 extended_analog (PWM or servo) to a pin
+                                 replaces a write to the same pin that is
+                                 still waiting in the write batching
+                                 queue, so only the newest value is sent.
+        :param max_output_rate: Optional maximum number of analog_write or
+                                extended_analog updates per second for each
+                                pin. Faster updates are held back and only
+                                the newest is sent when the pin may be
+                                updated again.
+        :param bulk_write_limit: Optional maximum number of bytes of
+                                 PRIORITY_BULK frames, such as i2c
+                                 transfers, sent by each write batching
+                                 flush. The rest wait for later flushes,
+                                 so higher priority commands queued
+                                 meanwhile are not held up behind them.
+                                 Priorities only take effect when
+                                 write_batch_window is not None. Without
+                                 batching every command is written as
+                                 soon as it is issued.
+        :param probe_ports: Used when neither com_port nor ip_address is
+                            given. If True, the USB serial ports of
+                            Arduino compatible boards are sent a firmware
+                            query to find the Firmata boards. If False,
+                            no port is queried and the last port used
+                            (see cache_file) or the first of those ports
+                            is opened.
 
         :returns: This method never returns
         """
@@ -85,6 +165,7 @@ class PymataCore:
 
         self.sleep_tune = sleep_tune
         self.arduino_wait = arduino_wait
+        self.probe_ports = probe_ports
         self.com_port = com_port
         if ip_address == 'None':
             self.ip_address = None
@@ -92,6 +173,12 @@ class PymataCore:
             self.ip_address = ip_address
         self.ip_port = int(ip_port)
         self.ip_handshake = ip_handshake
+        self.transport = transport
+        self.exit_on_error = exit_on_error
+
+        if event_driven_serial is None:
+            event_driven_serial = sys.platform.startswith('linux')
+        self.event_driven_serial = event_driven_serial
 
         self.hall_encoder = False
 
@@ -130,6 +217,22 @@ class PymataCore:
                                  PrivateConstants.ANALOG_MAPPING_RESPONSE: None,
                                  PrivateConstants.PIN_STATE_RESPONSE: None}
 
+        # futures for queries awaiting a reply. The key is the reply
+        # message type and the value is a list of futures in the order
+        # the queries were sent
+        self.query_timeout = query_timeout
+        self._pending_queries = {}
+
+        # number of pin state and i2c queries that timed out and whose
+        # replies may still arrive, by query key
+        self._late_replies = {}
+
+        # replies taken to be late while a newer query with the same key
+        # was waiting. The newer query receives the reply if nothing else
+        # arrives before it times out, in case the board had dropped the
+        # query that timed out.
+        self._held_replies = {}
+
         # An i2c_map entry consists of a device i2c address as the key, and
         #  the value of the key consists of a dictionary containing 3 entries.
         #  The first entry. 'value' contains the last value reported, and
@@ -194,6 +297,18 @@ class PymataCore:
 
         self.latch_map = {}
 
+        # the last value reported for each digital port. Pin callbacks are
+        # only called for the bits that differ from it. A port with no
+        # entry reports every pin.
+        self._digital_port_values = {}
+
+        # port: [callback, callback type] - see set_digital_port_callback
+        self.digital_port_callbacks = {}
+
+        # analog pin: [deadband, minimum interval, last value delivered,
+        #              time last value delivered] - see set_analog_filter
+        self.analog_filters = {}
+
         if self.log_output:
             log_string = 'pymata_aio Version ' + \
                          PrivateConstants.PYMATA_VERSION + \
@@ -207,7 +322,18 @@ class PymataCore:
                                   'rights reserved.\n'))
             sys.stdout.flush()
 
-        if self.com_port is None and self.ip_address is None:
+        if cache_file:
+            self.board_cache = BoardCache(cache_file)
+        else:
+            self.board_cache = None
+
+        # list of (port, firmware ID) for every board found by port
+        # discovery. The firmware ID is None for a port that was not probed.
+        self.discovered_boards = []
+
+        if self.transport is not None:
+            pass
+        elif self.com_port is None and self.ip_address is None:
             self.com_port = self._discover_port()
         elif self.ip_address is not None:
             if self.log_output:
@@ -220,9 +346,12 @@ class PymataCore:
 
         self.sleep_tune = sleep_tune
 
-        # a list of PinData objects - one for each pin segregate by pin type
-        self.analog_pins = []
-        self.digital_pins = []
+        # pin state tables - one for each pin type
+        self.analog_pins = PinTable()
+        self.digital_pins = PinTable()
+
+        # event loop time at which the chunk being dispatched was received
+        self._rx_time = 0.0
         self.pixy_blocks = []
         self.loop = None
         self.the_task = None
@@ -232,14 +361,73 @@ class PymataCore:
         # The correct reader and writer methods will be set after
         # the system detects if a serial or socket connection was chosen
         self.read = None
+        self.read_bytes = None
         self.write = None
 
+        # PymataRecorder wrapping the transport when record_file is set
+        self.record_file = record_file
+        self.recorder = None
+
+        # the last value written to each digital output port
+        self.digital_output_port_pins = \
+            list(PrivateConstants.DIGITAL_OUTPUT_PORT_PINS)
+
+        # the last value sent to each output, by kind of write, used to
+        # skip redundant writes, and the number of writes skipped
+        self.suppress_redundant_writes = suppress_redundant_writes
+        self._last_writes = {'analog': {}, 'digital_pin': {},
+                             'digital_port': {}}
+        self.suppressed_writes = {'analog': 0, 'digital_pin': 0,
+                                  'digital_port': 0}
+
+        # set by close() and, when exit_on_error is False, the exception
+        # that stopped the command dispatcher or a scheduled write
+        self.closed = False
+        self.error = None
+
         self.keep_alive_interval = 0
         self.period = 0
         self.margin = 0
 
+        # outbound frames waiting to be combined into a single write
+        # when write batching is enabled - one queue per priority class.
+        # Each flush sends the queues in priority order.
+        self.write_batch_window = write_batch_window
+        self._write_queues = [[], [], []]
+        self._flush_handle = None
+
+        # scheduled flushes and rate limited writes still in progress
+        self._write_tasks = set()
+        self.bulk_write_limit = bulk_write_limit
+
+        # priority class of each outbound command. Channel messages are
+        # keyed by command without the channel, sysex messages by sysex
+        # command. Commands not listed are PRIORITY_CONTROL.
+        self.frame_priorities = {
+            PrivateConstants.SYSTEM_RESET: Constants.PRIORITY_SAFETY,
+            PrivateConstants.I2C_REQUEST: Constants.PRIORITY_BULK,
+            PrivateConstants.STRING_DATA: Constants.PRIORITY_BULK}
+
+        # priority class of output pins set with set_output_priority.
+        # This overrides frame_priorities for writes to the pin.
+        self.output_priorities = {}
+
+        # output coalescing: pin: (priority, index) of its queued frame
+        self.coalesce_outputs = coalesce_outputs
+        self._queued_outputs = {}
+
+        # output rate limiting: pin: time of the last frame queued and
+        # pin: [held back frame, release timer handle]
+        self.max_output_rate = max_output_rate
+        self._output_times = {}
+        self._deferred_outputs = {}
+
+        # number of output frames replaced by a newer value
+        self.coalesced_writes = 0
+
         # set up signal handler for controlC
-        self.loop = asyncio.get_event_loop()
+        self.loop = loop or asyncio.get_event_loop()
+        self._loop_argument = loop
 
     def start(self):
         """
@@ -252,23 +440,26 @@ class PymataCore:
         :returns: No return value.
         """
 
-        # check if user specified a socket transport
-        if self.ip_address:
-            self.socket = PymataSocket(self.ip_address, self.ip_port, self.loop)
+        # check if user supplied a transport or specified a socket transport
+        if self.transport is not None:
+            self._set_transport(self.transport)
+        elif self.ip_address:
+            self.socket = PymataSocket(self.ip_address, self.ip_port, self.loop,
+                                       self.exit_on_error)
             self.loop.run_until_complete((self.socket.start()))
             # set the read and write handles
-            self.read = self.socket.read
-            self.write = self.socket.write
+            self._set_transport(self.socket)
             for i in range(0, len(self.ip_handshake)):
                 self.loop.run_until_complete((self.read()))
         else:
             try:
                 self.serial_port = PymataSerial(self.com_port, 57600,
                                                 self.sleep_tune,
-                                                self.log_output)
+                                                self.log_output,
+                                                self.event_driven_serial,
+                                                self.exit_on_error)
                 # set the read and write handles
-                self.read = self.serial_port.read
-                self.write = self.serial_port.write
+                self._set_transport(self.serial_port)
             except serial.SerialException:
                 if self.log_output:
                     log_string = 'Cannot instantiate serial interface: ' \
@@ -277,27 +468,31 @@ class PymataCore:
                 else:
                     print(
                         'Cannot instantiate serial interface: ' + self.com_port)
+                if not self.exit_on_error:
+                    raise
                 sys.exit(0)
 
-        # wait for arduino to go through a reset cycle if need be
-        time.sleep(self.arduino_wait)
-
         # register the get_command method with the event loop
         # self.loop = asyncio.get_event_loop()
         self.the_task = self.loop.create_task(self._command_dispatcher())
 
-        # get arduino firmware version and print it
-        asyncio.ensure_future(self.get_firmware_version())
-
-        firmware_version = self.loop.run_until_complete(self.get_firmware_version())
+        # wait for arduino to go through a reset cycle if need be
+        # and then print the firmware version
+        firmware_version = self.loop.run_until_complete(self._wait_for_board())
         if self.log_output:
-            log_string = "\nArduino Firmware ID: " + firmware_version
+            log_string = "\nArduino Firmware ID: " + str(firmware_version)
             logging.exception(log_string)
         else:
-            print("\nArduino Firmware ID: " + firmware_version)
-
-        # get an analog pin map
-        asyncio.ensure_future(self.get_analog_map())
+            print("\nArduino Firmware ID: " + str(firmware_version))
+
+        # if this board and firmware are in the cache, build the pin lists
+        # now and check them against the board in the background
+        cached_board = self._load_cached_board(firmware_version)
+        if cached_board:
+            self._build_pin_lists(cached_board['analog_map'])
+            self.loop.create_task(
+                self._verify_cached_board(cached_board, firmware_version))
+            return
 
         # try to get an analog report. if it comes back as none - shutdown
         report = self.loop.run_until_complete(self.get_analog_map())
@@ -314,6 +509,9 @@ class PymataCore:
                 print('*** Analog map retrieval timed out. ***')
                 print('\nDo you have Arduino connectivity and do you have a '
                       'Firmata sketch uploaded to the board?')
+            if not self.exit_on_error:
+                self.loop.run_until_complete(self.close())
+                raise RuntimeError('Analog map retrieval timed out')
             try:
                 loop = self.loop
                 for t in asyncio.Task.all_tasks(loop):
@@ -330,24 +528,11 @@ class PymataCore:
                 sys.exit(0)
 
         # custom assemble the pin lists
-        for pin in report:
-            digital_data = PinData()
-            self.digital_pins.append(digital_data)
-            if pin != Constants.IGNORE:
-                analog_data = PinData()
-                self.analog_pins.append(analog_data)
+        self._build_pin_lists(report)
 
-        if self.log_output:
-            log_string = 'Auto-discovery complete. Found ' + \
-                         str(len(self.digital_pins)) + ' Digital Pins and ' + \
-                         str(len(self.analog_pins)) + ' Analog Pins'
-            logging.info(log_string)
-        else:
-            print('{} {} {} {} {}'.format('Auto-discovery complete. Found',
-                                          len(self.digital_pins),
-                                          'Digital Pins and',
-                                          len(self.analog_pins),
-                                          'Analog Pins\n\n'))
+        if self.board_cache:
+            self.loop.create_task(self._update_board_cache(firmware_version,
+                                                           report))
 
     async def start_aio(self):
         """
@@ -358,17 +543,22 @@ class PymataCore:
 
         :returns: No return value.
          """
+        # without a loop argument, use the loop running this coroutine
+        if self._loop_argument is None:
+            self.loop = asyncio.get_event_loop()
 
         # pick the desired transport and then setup read and write to
         # point to the correct method for the transport
 
-        # check if user specified a socket transport
-        if self.ip_address:
-            self.socket = PymataSocket(self.ip_address, self.ip_port, self.loop)
+        # check if user supplied a transport or specified a socket transport
+        if self.transport is not None:
+            self._set_transport(self.transport)
+        elif self.ip_address:
+            self.socket = PymataSocket(self.ip_address, self.ip_port, self.loop,
+                                       self.exit_on_error)
             await self.socket.start()
             # set the read and write handles
-            self.read = self.socket.read
-            self.write = self.socket.write
+            self._set_transport(self.socket)
             for i in range(0, len(self.ip_handshake)):
                 await self.read()
 
@@ -376,11 +566,12 @@ class PymataCore:
             try:
                 self.serial_port = PymataSerial(self.com_port, 57600,
                                                 self.sleep_tune,
-                                                self.log_output)
+                                                self.log_output,
+                                                self.event_driven_serial,
+                                                self.exit_on_error)
 
                 # set the read and write handles
-                self.read = self.serial_port.read
-                self.write = self.serial_port.write
+                self._set_transport(self.serial_port)
 
             except serial.SerialException:
                 if self.log_output:
@@ -390,28 +581,32 @@ class PymataCore:
                 else:
                     print(
                         'Cannot instantiate serial interface: ' + self.com_port)
+                if not self.exit_on_error:
+                    raise
                 sys.exit(0)
 
-        # wait for arduino to go through a reset cycle if need be
-        time.sleep(self.arduino_wait)
-
         # register the get_command method with the event loop
-        self.loop = asyncio.get_event_loop()
         self.the_task = self.loop.create_task(self._command_dispatcher())
 
-        # get arduino firmware version and print it
-        firmware_version = await self.get_firmware_version()
+        # wait for arduino to go through a reset cycle if need be
+        # and then print the firmware version
+        firmware_version = await self._wait_for_board()
         if self.log_output:
-            log_string = "\nArduino Firmware ID: " + firmware_version
+            log_string = "\nArduino Firmware ID: " + str(firmware_version)
             logging.exception(log_string)
         else:
-            print("\nArduino Firmware ID: " + firmware_version)
-
-        # get an analog pin map
-        asyncio.ensure_future(self.get_analog_map())
+            print("\nArduino Firmware ID: " + str(firmware_version))
+
+        # if this board and firmware are in the cache, build the pin lists
+        # now and check them against the board in the background
+        cached_board = self._load_cached_board(firmware_version)
+        if cached_board:
+            self._build_pin_lists(cached_board['analog_map'])
+            self.loop.create_task(
+                self._verify_cached_board(cached_board, firmware_version))
+            return
 
         # try to get an analog report. if it comes back as none - shutdown
-        # report = await self.get_analog_map()
         report = await self.get_analog_map()
         if not report:
             if self.log_output:
@@ -426,6 +621,9 @@ class PymataCore:
                 print('*** Analog map retrieval timed out. ***')
                 print('\nDo you have Arduino connectivity and do you have a '
                       'Firmata sketch uploaded to the board?')
+            if not self.exit_on_error:
+                await self.close()
+                raise RuntimeError('Analog map retrieval timed out')
             try:
                 loop = self.loop
                 for t in asyncio.Task.all_tasks(loop):
@@ -444,24 +642,11 @@ class PymataCore:
                 sys.exit(0)
 
         # custom assemble the pin lists
-        for pin in report:
-            digital_data = PinData()
-            self.digital_pins.append(digital_data)
-            if pin != Constants.IGNORE:
-                analog_data = PinData()
-                self.analog_pins.append(analog_data)
+        self._build_pin_lists(report)
 
-        if self.log_output:
-            log_string = 'Auto-discovery complete. Found ' + \
-                         str(len(self.digital_pins)) + ' Digital Pins and ' + \
-                         str(len(self.analog_pins)) + ' Analog Pins'
-            logging.info(log_string)
-        else:
-            print('{} {} {} {} {}'.format('Auto-discovery complete. Found',
-                                          len(self.digital_pins),
-                                          'Digital Pins and',
-                                          len(self.analog_pins),
-                                          'Analog Pins\n\n'))
+        if self.board_cache:
+            self.loop.create_task(self._update_board_cache(firmware_version,
+                                                           report))
 
     async def analog_read(self, pin):
         """
@@ -470,22 +655,91 @@ class PymataCore:
         :param pin: Analog pin number (ex. A2 is specified as 2)
         :returns: Last value reported for the analog pin
         """
-        return self.analog_pins[pin].current_value
+        return self.analog_pins.values[pin]
+
+    def analog_snapshot(self):
+        """
+        Retrieve the last data update for every analog pin as a
+        consistent snapshot. This is not a coroutine. It does not use the
+        event loop and may be called from any thread.
+
+        :returns: A (version, values, time stamps) tuple. version changes
+                  whenever an analog pin is updated.
+        """
+        return self.analog_pins.versioned_snapshot()
 
-    async def analog_write(self, pin, value):
+    async def analog_write(self, pin, value, force=False):
         """
         Set the selected pin to the specified value.
 
         :param pin: PWM pin number
         :param value: Pin value (0 - 0x4000)
+        :param force: Send the value even if it is the last value sent
         :returns: No return value
         """
         if PrivateConstants.ANALOG_MESSAGE + pin < 0xf0:
+            if self._redundant_write('analog', pin, value, force):
+                return
             command = [PrivateConstants.ANALOG_MESSAGE + pin, value & 0x7f,
                        (value >> 7) & 0x7f]
-            await self._send_command(command)
+            await self._send_command(command, output=pin,
+                                     priority=self.output_priorities.get(pin))
         else:
-            await self.extended_analog(pin, value)
+            await self.extended_analog(pin, value, force)
+
+    async def close(self):
+        """
+        Reset the board, stop the command dispatcher and close the
+        connection. Unlike shutdown(), the event loop is left running and
+        the process does not exit, so other boards sharing the loop are
+        not affected.
+
+        :returns: No return value
+        """
+        if self.closed:
+            return
+        self.closed = True
+
+        # the connection may already be broken
+        try:
+            await self.send_reset()
+        except Exception:
+            pass
+
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        for queue in self._write_queues:
+            del queue[:]
+        self._queued_outputs.clear()
+        for frame, handle in self._deferred_outputs.values():
+            handle.cancel()
+        self._deferred_outputs.clear()
+
+        self._late_replies.clear()
+        self._held_replies.clear()
+
+        # queries still waiting for a reply return None, as on a timeout
+        for pending in self._pending_queries.values():
+            for future in pending:
+                if not future.done():
+                    future.set_result(None)
+
+        if self.the_task is not None:
+            self.the_task.cancel()
+
+        if self.recorder:
+            self.recorder.close()
+
+        try:
+            if self.serial_port:
+                await self.serial_port.close()
+            elif self.socket:
+                await self.socket.close()
+            elif hasattr(self.transport, 'close'):
+                await self.transport.close()
+        except Exception:
+            pass
 
     async def digital_read(self, pin):
         """
@@ -494,47 +748,100 @@ class PymataCore:
         :param pin: Digital pin number
         :returns: Last value reported for the digital pin
         """
-        return self.digital_pins[pin].current_value
+        return self.digital_pins.values[pin]
+
+    def digital_snapshot(self):
+        """
+        Retrieve the last data update for every digital pin as a
+        consistent snapshot. This is not a coroutine. It does not use the
+        event loop and may be called from any thread.
 
-    async def digital_pin_write(self, pin, value):
+        :returns: A (version, values, time stamps) tuple. version changes
+                  once for each digital port report.
+        """
+        return self.digital_pins.versioned_snapshot()
+
+    async def digital_pin_write(self, pin, value, force=False):
         """
         Set the specified pin to the specified value directly without port manipulation.
 
         :param pin: pin number
         :param value: pin value
+        :param force: Send the value even if it is the last value sent
         :returns: No return value
         """
+        if self._redundant_write('digital_pin', pin, value, force):
+            return
+        # the port value last sent no longer describes this pin
+        self._last_writes['digital_port'].pop(pin // 8, None)
 
         command = (PrivateConstants.SET_DIGITAL_PIN_VALUE, pin, value)
 
-        await self._send_command(command)
+        await self._send_command(command,
+                                 priority=self.output_priorities.get(pin))
 
-    async def digital_write(self, pin, value):
+    async def digital_port_write(self, port, mask, values, force=False):
+        """
+        Set several pins of one digital port with a single message.
+
+        :param port: Port number. Port 0 is pins 0-7, port 1 is pins 8-15...
+        :param mask: Bit mask of the port pins to change. Bit 0 is the
+                     first pin of the port.
+        :param values: Bit values of the port pins selected by mask
+        :param force: Send the port even if it is the last value sent
+        :returns: No return value
+        """
+        mask &= 0xff
+        self.digital_output_port_pins[port] = \
+            (self.digital_output_port_pins[port] & ~mask) | (values & mask)
+
+        await self._send_digital_port(port, force,
+                                      self._port_priority(port, mask))
+
+    async def digital_write(self, pin, value, force=False):
         """
         Set the specified pin to the specified value.
 
         :param pin: pin number
         :param value: pin value
+        :param force: Send the port even if it is the last value sent
         :returns: No return value
         """
         # The command value is not a fixed value, but needs to be calculated
         # using the pin's port number
         port = pin // 8
 
-        calculated_command = PrivateConstants.DIGITAL_MESSAGE + port
         mask = 1 << (pin % 8)
         # Calculate the value for the pin's position in the port mask
         if value == 1:
-            PrivateConstants.DIGITAL_OUTPUT_PORT_PINS[port] |= mask
+            self.digital_output_port_pins[port] |= mask
         else:
-            PrivateConstants.DIGITAL_OUTPUT_PORT_PINS[port] &= ~mask
+            self.digital_output_port_pins[port] &= ~mask
 
-        # Assemble the command
-        command = (calculated_command,
-                   PrivateConstants.DIGITAL_OUTPUT_PORT_PINS[port] & 0x7f,
-                   (PrivateConstants.DIGITAL_OUTPUT_PORT_PINS[port] >> 7) & 0x7f)
+        await self._send_digital_port(port, force,
+                                      self.output_priorities.get(pin))
 
-        await self._send_command(command)
+    async def digital_write_many(self, pin_values, force=False):
+        """
+        Set several digital pins. The changes are grouped by port and one
+        message is sent for each port affected.
+
+        :param pin_values: Dictionary of pin number: pin value
+        :param force: Send the ports even if they are the last values sent
+        :returns: No return value
+        """
+        ports = {}
+        for pin, value in pin_values.items():
+            mask, values = ports.get(pin // 8, (0, 0))
+            bit = 1 << (pin % 8)
+            mask |= bit
+            if value == 1:
+                values |= bit
+            ports[pin // 8] = (mask, values)
+
+        for port in sorted(ports):
+            mask, values = ports[port]
+            await self.digital_port_write(port, mask, values, force)
 
     async def disable_analog_reporting(self, pin):
         """
@@ -602,7 +909,7 @@ class PymataCore:
         :param pin: Encoder Pin
         :returns: encoder data value
         """
-        return self.digital_pins[pin].current_value
+        return self.digital_pins.values[pin]
 
     async def enable_analog_reporting(self, pin):
         """
@@ -624,21 +931,73 @@ class PymataCore:
         :returns: No return value
             """
         port = pin // 8
+        # the report sent in reply is delivered for every pin of the port
+        self._digital_port_values.pop(port, None)
         command = [PrivateConstants.REPORT_DIGITAL + port,
                    PrivateConstants.REPORTING_ENABLE]
         await self._send_command(command)
 
-    async def extended_analog(self, pin, data):
+    async def extended_analog(self, pin, data, force=False):
         """
         This method will send an extended-data analog write command to the
         selected pin.
 
         :param pin: 0 - 127
         :param data: 0 - 0xfffff
+        :param force: Send the value even if it is the last value sent
         :returns: No return value
         """
+        if self._redundant_write('analog', pin, data, force):
+            return
         analog_data = [pin, data & 0x7f, (data >> 7) & 0x7f, (data >> 14) & 0x7f]
-        await self._send_sysex(PrivateConstants.EXTENDED_ANALOG, analog_data)
+        await self._send_sysex(PrivateConstants.EXTENDED_ANALOG, analog_data,
+                               output=pin,
+                               priority=self.output_priorities.get(pin))
+
+    async def flush_writes(self):
+        """
+        Send all queued outbound commands to Firmata in a single write.
+        Call this after a group of commands when write batching is enabled
+        and the commands must not wait for the batching window to expire.
+
+        Control frames are sent first and then bulk frames, up to
+        bulk_write_limit bytes of them. Safety frames are never queued:
+        they are written at once, after the control frames queued before
+        them and ahead of queued bulk frames.
+
+        :returns: Number of bytes written
+        """
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        safety, control, bulk = self._write_queues
+        frames = safety + control
+        del safety[:]
+        del control[:]
+        self._queued_outputs = {}
+
+        if self.bulk_write_limit is None:
+            frames += bulk
+            del bulk[:]
+        else:
+            size = 0
+            count = 0
+            for frame in bulk:
+                # always send at least one frame so that bulk traffic
+                # keeps moving
+                if count and size + len(frame) > self.bulk_write_limit:
+                    break
+                size += len(frame)
+                count += 1
+            frames += bulk[:count]
+            del bulk[:count]
+            if bulk:
+                self._schedule_flush()
+
+        if not frames:
+            return 0
+        return await self.write(b''.join(frames))
 
     async def get_analog_latch_data(self, pin):
         """
@@ -658,44 +1017,32 @@ class PymataCore:
         else:
             return None
 
-    async def get_analog_map(self):
+    async def get_analog_map(self, timeout=None):
         """
         This method requests a Firmata analog map query and returns the results.
 
+        :param timeout: Seconds to wait for the reply. Defaults to the
+                        query_timeout passed to the constructor.
         :returns: An analog map response or None if a timeout occurs
         """
-        # get the current time to make sure a report is retrieved
-        current_time = time.time()
-
-        # if we do not have existing report results, send a Firmata
-        # message to request one
-        if self.query_reply_data.get(
-                PrivateConstants.ANALOG_MAPPING_QUERY) is None:
-            await self._send_sysex(PrivateConstants.ANALOG_MAPPING_QUERY, None)
-            # wait for the report results to return for 2 seconds
-            # if the timer expires, shutdown
-            while self.query_reply_data.get(
-                    PrivateConstants.ANALOG_MAPPING_RESPONSE) is None:
-                elapsed_time = time.time()
-                if elapsed_time - current_time > 2:
-                    return None
-                await asyncio.sleep(self.sleep_tune)
-        return self.query_reply_data.get(
-            PrivateConstants.ANALOG_MAPPING_RESPONSE)
+        return await self._query(PrivateConstants.ANALOG_MAPPING_RESPONSE,
+                                 self._send_sysex(
+                                     PrivateConstants.ANALOG_MAPPING_QUERY),
+                                 timeout)
 
-    async def get_capability_report(self):
+    async def get_capability_report(self, timeout=None):
         """
         This method requests and returns a Firmata capability query report
 
-        :returns: A capability report in the form of a list
+        :param timeout: Seconds to wait for the reply. Defaults to the
+                        query_timeout passed to the constructor.
+        :returns: A capability report in the form of a list or None if a
+                  timeout occurs
         """
-        if self.query_reply_data.get(
-                PrivateConstants.CAPABILITY_QUERY) is None:
-            await self._send_sysex(PrivateConstants.CAPABILITY_QUERY, None)
-            while self.query_reply_data.get(
-                    PrivateConstants.CAPABILITY_RESPONSE) is None:
-                await asyncio.sleep(self.sleep_tune)
-        return self.query_reply_data.get(PrivateConstants.CAPABILITY_RESPONSE)
+        return await self._query(PrivateConstants.CAPABILITY_RESPONSE,
+                                 self._send_sysex(
+                                     PrivateConstants.CAPABILITY_QUERY),
+                                 timeout)
 
     async def get_digital_latch_data(self, pin):
         """
@@ -714,55 +1061,103 @@ class PymataCore:
         else:
             return None
 
-    async def get_firmware_version(self):
+    async def get_firmware_version(self, timeout=None):
         """
         This method retrieves the Firmata firmware version
 
-        :returns: Firmata firmware version
+        :param timeout: Seconds to wait for the reply. Defaults to the
+                        query_timeout passed to the constructor.
+        :returns: Firmata firmware version or None if a timeout occurs
         """
         if self.query_reply_data.get(PrivateConstants.REPORT_FIRMWARE) == '':
-            await self._send_sysex(PrivateConstants.REPORT_FIRMWARE, None)
-            while self.query_reply_data.get(
-                    PrivateConstants.REPORT_FIRMWARE) == '':
-                await asyncio.sleep(self.sleep_tune)
-        reply = ''
-        for x in self.query_reply_data.get(PrivateConstants.REPORT_FIRMWARE):
-            reply_data = ord(x)
-            if reply_data:
-                reply += chr(reply_data)
-        self.query_reply_data[PrivateConstants.REPORT_FIRMWARE] = reply
+            return await self._query(PrivateConstants.REPORT_FIRMWARE,
+                                     self._send_sysex(
+                                         PrivateConstants.REPORT_FIRMWARE),
+                                     timeout)
         return self.query_reply_data.get(PrivateConstants.REPORT_FIRMWARE)
 
-    async def get_protocol_version(self):
+    async def get_protocol_version(self, timeout=None):
         """
         This method returns the major and minor values for the protocol
         version, i.e. 2.4
 
-        :returns: Firmata protocol version
+        :param timeout: Seconds to wait for the reply. Defaults to the
+                        query_timeout passed to the constructor.
+        :returns: Firmata protocol version or None if a timeout occurs
         """
         if self.query_reply_data.get(PrivateConstants.REPORT_VERSION) == '':
-            await self._send_command([PrivateConstants.REPORT_VERSION])
-            while self.query_reply_data.get(
-                    PrivateConstants.REPORT_VERSION) == '':
-                await asyncio.sleep(self.sleep_tune)
+            return await self._query(PrivateConstants.REPORT_VERSION,
+                                     self._send_command(
+                                         [PrivateConstants.REPORT_VERSION]),
+                                     timeout)
         return self.query_reply_data.get(PrivateConstants.REPORT_VERSION)
 
-    async def get_pin_state(self, pin):
+    async def get_pin_state(self, pin, timeout=None):
         """
         This method retrieves a pin state report for the specified pin
 
         :param pin: Pin of interest
-        :returns: pin state report
-        """
-        pin_list = [pin]
-        await self._send_sysex(PrivateConstants.PIN_STATE_QUERY, pin_list)
-        while self.query_reply_data.get(
-                PrivateConstants.PIN_STATE_RESPONSE) is None:
-            await asyncio.sleep(self.sleep_tune)
-        pin_state_report = self.query_reply_data.get(
-            PrivateConstants.PIN_STATE_RESPONSE)
-        self.query_reply_data[PrivateConstants.PIN_STATE_RESPONSE] = None
-        return pin_state_report
+        :param timeout: Seconds to wait for the reply. Defaults to the
+                        query_timeout passed to the constructor.
+        :returns: pin state report or None if a timeout occurs
+        """
+        return await self._query((PrivateConstants.PIN_STATE_RESPONSE, pin),
+                                 self._send_sysex(
+                                     PrivateConstants.PIN_STATE_QUERY, [pin]),
+                                 timeout)
+
+    async def get_pin_states(self, pins, timeout=None):
+        """
+        This method retrieves pin state reports for a group of pins.
+        All of the queries are sent at once and each reply is matched
+        to its pin by the pin number in the report.
+
+        :param pins: An iterable of pin numbers
+        :param timeout: Seconds to wait for all of the replies. Defaults to
+                        the query_timeout passed to the constructor.
+        :returns: A dictionary of pin number to pin state report. The report
+                  is None for any pin that did not reply in time.
+        """
+        if timeout is None:
+            timeout = self.query_timeout
+        futures = {}
+        for pin in pins:
+            futures[pin] = self._register_query(
+                (PrivateConstants.PIN_STATE_RESPONSE, pin))
+        try:
+            for pin in futures:
+                await self._send_sysex(PrivateConstants.PIN_STATE_QUERY, [pin])
+            if futures:
+                await asyncio.wait(list(futures.values()), timeout=timeout)
+        finally:
+            for pin, future in futures.items():
+                key = (PrivateConstants.PIN_STATE_RESPONSE, pin)
+                if not future.done():
+                    if key in self._held_replies:
+                        future.set_result(self._held_replies.pop(key))
+                    else:
+                        self._expect_late_reply(key)
+                self._unregister_query(key, future)
+
+        reports = {}
+        for pin, future in futures.items():
+            if future.done() and not future.cancelled():
+                reports[pin] = future.result()
+            else:
+                reports[pin] = None
+        return reports
+
+    async def get_all_pin_states(self, timeout=None):
+        """
+        This method retrieves a pin state report for every digital pin
+        discovered on the board. See get_pin_states().
+
+        :param timeout: Seconds to wait for all of the replies. Defaults to
+                        the query_timeout passed to the constructor.
+        :returns: A dictionary of pin number to pin state report
+        """
+        return await self.get_pin_states(range(len(self.digital_pins)),
+                                         timeout)
 
     # noinspection PyMethodMayBeStatic
     async def get_pymata_version(self):
@@ -786,6 +1181,34 @@ class PymataCore:
         data = [read_delay_time & 0x7f, (read_delay_time >> 7) & 0x7f]
         await self._send_sysex(PrivateConstants.I2C_CONFIG, data)
 
+    async def i2c_read(self, address, register, number_of_bytes,
+                       read_type=Constants.I2C_READ, timeout=None):
+        """
+        This method reads an i2c device and waits for the reply to this
+        request. Replies are matched to requests by device address and
+        register, so reads of several devices or registers may be in
+        progress at the same time.
+
+        Some devices require that transmission be restarted
+        (e.g. MMA8452Q accelerometer).
+        Use Constants.I2C_READ | Constants.I2C_RESTART_TX for those cases.
+
+        :param address: i2c device address
+        :param register: register number (can be set to zero)
+        :param number_of_bytes: number of bytes to read
+        :param read_type: I2C_READ. I2C_RESTART_TX may be OR'ed when
+                          required
+        :param timeout: Seconds to wait for the reply. None selects
+                        query_timeout.
+        :returns: List of the bytes read, without the address and register,
+                  or None if a timeout occurs
+        """
+        key = (PrivateConstants.I2C_REPLY, address, register)
+        data = [address, read_type, register & 0x7f, (register >> 7) & 0x7f,
+                number_of_bytes & 0x7f, (number_of_bytes >> 7) & 0x7f]
+        return await self._query(key, self._send_sysex(
+            PrivateConstants.I2C_REQUEST, data), timeout)
+
     async def i2c_read_data(self, address):
         """
         This method retrieves cached i2c data to support a polling mode.
@@ -916,9 +1339,19 @@ class PymataCore:
 
         :returns: No return value.
         """
+        # the board returns every output to its default state
+        for last_values in self._last_writes.values():
+            last_values.clear()
+        self._digital_port_values.clear()
+        for frame, handle in self._deferred_outputs.values():
+            handle.cancel()
+        self._deferred_outputs.clear()
         try:
-            await self._send_command([PrivateConstants.SYSTEM_RESET])
+            await self._send_command([PrivateConstants.SYSTEM_RESET],
+                                     immediate=True)
         except RuntimeError:
+            if not self.exit_on_error:
+                raise
             exit(0)
 
     async def servo_config(self, pin, min_pulse=544, max_pulse=2400):
@@ -935,8 +1368,39 @@ class PymataCore:
         command = [pin, min_pulse & 0x7f, (min_pulse >> 7) & 0x7f, max_pulse & 0x7f,
                    (max_pulse >> 7) & 0x7f]
 
+        self._forget_writes(pin)
         await self._send_sysex(PrivateConstants.SERVO_CONFIG, command)
 
+    async def set_analog_filter(self, pin, deadband=None,
+                                deadband_percent=None, min_interval=None):
+        """
+        Filter the reports for an analog pin before its callback and latch
+        are processed. The pin value returned by analog_read is always the
+        latest value reported.
+
+        A report is passed on when it differs from the last value passed on
+        by more than the deadband, and at least min_interval seconds have
+        passed since then.
+
+        Calling this method with no filter parameters removes the filter.
+
+        :param pin: Analog pin number (ex. A2 is specified as 2)
+        :param deadband: Values within this distance of the last value
+                         passed on are dropped. 0 passes on changes only.
+        :param deadband_percent: Deadband as a percentage of the 10 bit
+                                 full scale (1023). Used instead of
+                                 deadband.
+        :param min_interval: Minimum number of seconds between reports
+                             passed on
+        :returns: No return value
+        """
+        if deadband_percent is not None:
+            deadband = deadband_percent * 1023 / 100
+        if deadband is None and not min_interval:
+            self.analog_filters.pop(pin, None)
+        else:
+            self.analog_filters[pin] = [deadband, min_interval, None, None]
+
     async def set_analog_latch(self, pin, threshold_type, threshold_value,
                                cb=None, cb_type=None):
         """
@@ -967,6 +1431,24 @@ class PymataCore:
         else:
             return False
 
+    async def set_digital_port_callback(self, port, cb=None, cb_type=None):
+        """
+        Register a callback for a whole digital input port. It is called
+        once for each report in which at least one pin of the port changed,
+        with the data [port, port value, mask of the changed pins].
+        Bit 0 of the value and mask is the first pin of the port.
+
+        :param port: Port number. Port 0 is pins 0-7, port 1 is pins 8-15...
+        :param cb: callback method. None removes the callback.
+        :param cb_type: Constants.CB_TYPE_DIRECT = direct call or
+                        Constants.CB_TYPE_ASYNCIO = asyncio coroutine
+        :returns: No return value
+        """
+        if cb:
+            self.digital_port_callbacks[port] = [cb, cb_type]
+        else:
+            self.digital_port_callbacks.pop(port, None)
+
     async def set_digital_latch(self, pin, threshold_value, cb=None,
                                 cb_type=None):
         """
@@ -993,6 +1475,26 @@ class PymataCore:
         else:
             return False
 
+    async def set_output_priority(self, pin, priority=None):
+        """
+        Set the priority class of writes to an output pin. Writes to a
+        PRIORITY_SAFETY pin, such as an actuator stop, are never rate
+        limited or queued. They are written at once, ahead of queued bulk
+        traffic. Any older value still queued for the pin is dropped.
+
+        Priorities only take effect when write_batch_window is not None.
+        Without batching every command is written as soon as it is issued.
+
+        :param pin: Output pin number
+        :param priority: Constants.PRIORITY_SAFETY, PRIORITY_CONTROL or
+                         PRIORITY_BULK. None restores the default.
+        :returns: No return value
+        """
+        if priority is None:
+            self.output_priorities.pop(pin, None)
+        else:
+            self.output_priorities[pin] = priority
+
     async def set_pin_mode(self, pin_number, pin_state, callback=None,
                            callback_type=None):
         """
@@ -1016,11 +1518,11 @@ class PymataCore:
             await asyncio.sleep(2)
         if callback:
             if pin_state == Constants.INPUT:
-                self.digital_pins[pin_number].cb = callback
-                self.digital_pins[pin_number].cb_type = callback_type
+                self.digital_pins.set_callback(pin_number, callback,
+                                               callback_type)
             elif pin_state == Constants.ANALOG:
-                self.analog_pins[pin_number].cb = callback
-                self.analog_pins[pin_number].cb_type = callback_type
+                self.analog_pins.set_callback(pin_number, callback,
+                                              callback_type)
             else:
                 if self.log_output:
                     log_string = 'set_pin_mode: callback ignored for ' \
@@ -1032,6 +1534,7 @@ class PymataCore:
 
         pin_mode = pin_state
         command = [PrivateConstants.SET_PIN_MODE, pin_number, pin_mode]
+        self._forget_writes(pin_number)
         await self._send_command(command)
         if pin_state == Constants.ANALOG:
             await self.enable_analog_reporting(pin_number)
@@ -1066,8 +1569,15 @@ class PymataCore:
         else:
             print('Shutting down ...')
 
+        if not self.exit_on_error:
+            await self.close()
+            return
+
         await self.send_reset()
 
+        if self.recorder:
+            self.recorder.close()
+
         try:
             self.loop.stop()
         except:
@@ -1253,58 +1763,35 @@ class PymataCore:
         It continually accepts and interprets data coming from Firmata,and then
         dispatches the correct handler to process the data.
 
+        Each chunk of received data is decoded in a single pass by a
+        FirmataParser, which keeps partial messages between chunks.
+
         :returns: This method never returns
         """
-        # sysex commands are assembled into this list for processing
-        sysex = []
+        parser = FirmataParser()
 
         while True:
             try:
-                next_command_byte = await self.read()
-                # if this is a SYSEX command, then assemble the entire
-                # command process it
-                if next_command_byte == PrivateConstants.START_SYSEX:
-                    while next_command_byte != PrivateConstants.END_SYSEX:
-                        await asyncio.sleep(self.sleep_tune)
-                        next_command_byte = await self.read()
-                        sysex.append(next_command_byte)
-                    await self.command_dictionary[sysex[0]](sysex)
-                    sysex = []
-                    await asyncio.sleep(self.sleep_tune)
-                # if this is an analog message, process it.
-                elif 0xE0 <= next_command_byte < 0xEF:
-                    # analog message
-                    # assemble the entire analog message in command
-                    command = []
-                    # get the pin number for the message
-                    pin = next_command_byte & 0x0f
-                    command.append(pin)
-                    # get the next 2 bytes for the command
-                    command = await self._wait_for_data(command, 2)
-                    # process the analog message
-                    await self._analog_message(command)
-                # handle the digital message
-                elif 0x90 <= next_command_byte <= 0x9F:
-                    command = []
-                    pin = next_command_byte & 0x0f
-                    command.append(pin)
-                    command = await self._wait_for_data(command, 2)
-                    await self._digital_message(command)
-                # handle all other messages by looking them up in the
-                # command dictionary
-                elif next_command_byte in self.command_dictionary:
-                    await self.command_dictionary[next_command_byte]()
-                    await asyncio.sleep(self.sleep_tune)
-                else:
-                    # we need to yield back to the loop
-                    await asyncio.sleep(self.sleep_tune)
-                    continue
+                data = await self.read_bytes()
+                self._rx_time = self.loop.time()
+                for command, message in parser.feed(data):
+                    handler = self.command_dictionary.get(command)
+                    if handler:
+                        await handler(message)
+                # yield back to the loop in case more data is already waiting
+                await asyncio.sleep(0)
             except Exception as ex:
                 # A error occurred while transmitting the Firmata message, message arrived invalid.
                 if self.log_output:
                     logging.exception(ex)
                 else:
                     print(ex)
+                if not self.exit_on_error:
+                    # stop this board only
+                    self.error = ex
+                    await self.close()
+                    return
+
                 await self.shutdown()
 
                 await self.serial_port.close()
@@ -1330,8 +1817,7 @@ class PymataCore:
         :param data: response data
         :returns: none - but saves the response
         """
-        self.query_reply_data[PrivateConstants.ANALOG_MAPPING_RESPONSE] = \
-            data[1:-1]
+        self._query_reply(PrivateConstants.ANALOG_MAPPING_RESPONSE, data[1:-1])
 
     async def _analog_message(self, data):
         """
@@ -1343,18 +1829,37 @@ class PymataCore:
         """
         pin = data[0]
         value = (data[PrivateConstants.MSB] << 7) + data[PrivateConstants.LSB]
-        # if self.analog_pins[pin].current_value != value:
-        self.analog_pins[pin].current_value = value
+        analog_pins = self.analog_pins
+        analog_pins.version += 1
+        analog_pins.values[pin] = value
+        analog_pins.time_stamps[pin] = self._rx_time
+        analog_pins.update_counts[pin] += 1
+        analog_pins.version += 1
+
+        analog_filter = self.analog_filters.get(pin)
+        if analog_filter:
+            deadband, min_interval, last_value, last_time = analog_filter
+            if last_value is not None:
+                if deadband is not None and \
+                        abs(value - last_value) <= deadband:
+                    return
+                if min_interval:
+                    now = self.loop.time()
+                    if now - last_time < min_interval:
+                        return
+            analog_filter[2] = value
+            if min_interval:
+                analog_filter[3] = self.loop.time()
 
         # append pin number to return value and return as a list
         value = [pin, value]
 
-        if self.analog_pins[pin].cb:
-            if self.analog_pins[pin].cb_type:
-                await self.analog_pins[pin].cb(value)
+        callback = analog_pins.callbacks.get(pin)
+        if callback and callback[0]:
+            if callback[1]:
+                await callback[0](value)
             else:
-                loop = self.loop
-                loop.call_soon(self.analog_pins[pin].cb, value)
+                self.loop.call_soon(callback[0], value)
 
         # is there a latch entry for this pin?
         key = 'A' + str(pin)
@@ -1369,13 +1874,16 @@ class PymataCore:
         :param data: capability report
         :returns: None - but report is saved
         """
-        self.query_reply_data[PrivateConstants.CAPABILITY_RESPONSE] = data[1:-1]
+        self._query_reply(PrivateConstants.CAPABILITY_RESPONSE, data[1:-1])
 
     async def _digital_message(self, data):
         """
         This is a private message handler method.
         It is a message handler for Digital Messages.
 
+        Only the pins whose value differs from the previous report for
+        the port are visited.
+
         :param data: digital message
 
         :returns: None - but update is saved in pins structure
@@ -1383,23 +1891,60 @@ class PymataCore:
         port = data[0]
         port_data = (data[PrivateConstants.MSB] << 7) + \
                     data[PrivateConstants.LSB]
-        pin = port * 8
-        for pin in range(pin, min(pin + 8, len(self.digital_pins))):
-            self.digital_pins[pin].current_value = port_data & 0x01
-            data = [pin, self.digital_pins[pin].current_value]
-            if self.digital_pins[pin].cb:
-                if self.digital_pins[pin].cb_type:
-                    await self.digital_pins[pin].cb(data)
+
+        previous = self._digital_port_values.get(port)
+        self._digital_port_values[port] = port_data
+        if previous is None:
+            changed = 0xff
+        else:
+            changed = previous ^ port_data
+        if not changed:
+            return
+
+        port_callback = self.digital_port_callbacks.get(port)
+        if port_callback:
+            cb, cb_type = port_callback
+            if cb_type:
+                await cb([port, port_data, changed])
+            else:
+                self.loop.call_soon(cb, [port, port_data, changed])
+
+        first_pin = port * 8
+        digital_pins = self.digital_pins
+        pin_count = len(digital_pins)
+        rx_time = self._rx_time
+        updates = []
+        # the whole port update is a single version step, so snapshots
+        # never hold part of it
+        digital_pins.version += 1
+        while changed:
+            # visit the lowest changed bit
+            bit = changed & -changed
+            changed ^= bit
+            offset = bit.bit_length() - 1
+            pin = first_pin + offset
+            if pin >= pin_count:
+                break
+            value = (port_data >> offset) & 0x01
+            digital_pins.values[pin] = value
+            digital_pins.time_stamps[pin] = rx_time
+            digital_pins.update_counts[pin] += 1
+            updates.append((pin, value))
+        digital_pins.version += 1
+
+        for pin, value in updates:
+            callback = digital_pins.callbacks.get(pin)
+            if callback and callback[0]:
+                data = [pin, value]
+                if callback[1]:
+                    await callback[0](data)
                 else:
-                    # self.digital_pins[pin].cb(data)
-                    loop = self.loop
-                    loop.call_soon(self.digital_pins[pin].cb, data)
+                    self.loop.call_soon(callback[0], data)
 
                 # is there a latch entry for this pin?
                 key = 'D' + str(pin)
                 if key in self.latch_map:
-                    await self._check_latch_data(key, port_data & 0x01)
-            port_data >>= 1
+                    await self._check_latch_data(key, value)
 
     async def _encoder_data(self, data):
         """
@@ -1412,6 +1957,8 @@ class PymataCore:
         # strip off sysex start and end
         data = data[1:-1]
         pin = data[0]
+        digital_pins = self.digital_pins
+        callback = digital_pins.callbacks.get(pin)
         if not self.hall_encoder:
             val = int((data[PrivateConstants.MSB] << 7) +
                       data[PrivateConstants.LSB])
@@ -1420,26 +1967,22 @@ class PymataCore:
                 val -= 16384
             # if this value is different that is what is already in the
             # table store it and check for callback
-            if val != self.digital_pins[pin].current_value:
-                self.digital_pins[pin].current_value = val
-                if self.digital_pins[pin].cb:
-                    # self.digital_pins[pin].cb([pin, val])
-                    if self.digital_pins[pin].cb_type:
-                        await self.digital_pins[pin].cb(val)
+            if val != digital_pins.values[pin]:
+                digital_pins.update(pin, val, self._rx_time)
+                if callback and callback[0]:
+                    if callback[1]:
+                        await callback[0](val)
                     else:
-                        # self.digital_pins[pin].cb(data)
-                        loop = self.loop
-                        loop.call_soon(self.digital_pins[pin].cb, val)
+                        self.loop.call_soon(callback[0], val)
         else:
             hall_data = [int((data[2] << 7) + data[1]), int((data[5] << 7) +
                                                             data[4])]
 
-            if self.digital_pins[pin].cb_type:
-                await self.digital_pins[pin].cb(hall_data)
-            else:
-                # self.digital_pins[pin].cb(data)
-                loop = self.loop
-                loop.call_soon(self.digital_pins[pin].cb, hall_data)
+            if callback and callback[0]:
+                if callback[1]:
+                    await callback[0](hall_data)
+                else:
+                    self.loop.call_soon(callback[0], hall_data)
 
     # noinspection PyDictCreation
     async def _pixy_data(self, data):
@@ -1471,12 +2014,13 @@ class PymataCore:
             block["angle"] = int((data[i * 12 + 12] << 7) + data[i * 12 + 11])
             blocks.append(block)
         self.pixy_blocks = blocks
-        if self.digital_pins[PrivateConstants.PIN_PIXY_MOSI].cb:
-            if self.digital_pins[PrivateConstants.PIN_PIXY_MOSI].cb_type:
-                await self.digital_pins[PrivateConstants.PIN_PIXY_MOSI].cb(blocks)
+        callback = self.digital_pins.callbacks.get(
+            PrivateConstants.PIN_PIXY_MOSI)
+        if callback and callback[0]:
+            if callback[1]:
+                await callback[0](blocks)
             else:
-                loop = self.loop
-                loop.call_soon(self.digital_pins[PrivateConstants.PIN_PIXY_MOSI].cb, blocks)
+                self.loop.call_soon(callback[0], blocks)
 
     async def _i2c_reply(self, data):
         """
@@ -1494,6 +2038,15 @@ class PymataCore:
         reply_data = []
         # reassemble the data from the firmata 2 byte format
         address = (data[0] & 0x7f) + (data[1] << 7)
+        register = (data[2] & 0x7f) + (data[3] << 7)
+
+        # complete an i2c_read waiting for this address and register
+        key = (PrivateConstants.I2C_REPLY, address, register)
+        if key in self._pending_queries or key in self._late_replies:
+            reply_data = [(data[i] & 0x7f) + (data[i + 1] << 7)
+                          for i in range(4, len(data) - 1, 2)]
+            self._query_reply(PrivateConstants.I2C_REPLY, reply_data, key)
+            reply_data = []
 
         # if we have an entry in the i2c_map, proceed
         if address in self.i2c_map:
@@ -1527,7 +2080,9 @@ class PymataCore:
         :param data: Pin state message
         :returns: None - but response is saved
         """
-        self.query_reply_data[PrivateConstants.PIN_STATE_RESPONSE] = data[1:-1]
+        report = data[1:-1]
+        self._query_reply(PrivateConstants.PIN_STATE_RESPONSE, report,
+                          (PrivateConstants.PIN_STATE_RESPONSE, report[0]))
 
     async def _report_firmware(self, sysex_data):
         """
@@ -1563,30 +2118,32 @@ class PymataCore:
         name = sysex_data[3:-1]
 
         # convert the identifier to printable text and add each character
-        # to the version string
+        # to the version string. The identifier is sent as 7 bit pairs,
+        # so skip the zero high order bytes
         for e in name:
-            version_string += chr(e)
+            if e:
+                version_string += chr(e)
 
         # store the value
-        self.query_reply_data[PrivateConstants.REPORT_FIRMWARE] = version_string
+        self._query_reply(PrivateConstants.REPORT_FIRMWARE, version_string)
 
-    async def _report_version(self):
+    async def _report_version(self, data):
         """
         This is a private message handler method.
-        This method reads the following 2 bytes after the report version
+        This method handles the 2 bytes following the report version
         command (0xF9 - non sysex).
         The first byte is the major number and the second byte is the
         minor number.
 
+        :param data: [major, minor]
         :returns: None
         """
-        # get next two bytes
-        major = await self.read()
+        major = data[0]
         version_string = str(major)
-        minor = await self.read()
+        minor = data[1]
         version_string += '.'
         version_string += str(minor)
-        self.query_reply_data[PrivateConstants.REPORT_VERSION] = version_string
+        self._query_reply(PrivateConstants.REPORT_VERSION, version_string)
 
     async def _sonar_data(self, data):
         """
@@ -1652,6 +2209,190 @@ class PymataCore:
     utilities
     '''
 
+    def _build_pin_lists(self, report):
+        """
+        This is a private utility method.
+        It sizes the digital and analog pin lists to match an analog map
+        report. Existing pin values and callbacks are kept, so callbacks
+        survive when the tables are resized.
+
+        :param report: analog map report
+        :returns: No return value.
+        """
+        digital_count = len(report)
+        analog_count = len([pin for pin in report if pin != Constants.IGNORE])
+
+        self.digital_pins.resize(digital_count)
+        self.analog_pins.resize(analog_count)
+
+        if self.log_output:
+            log_string = 'Auto-discovery complete. Found ' + \
+                         str(len(self.digital_pins)) + ' Digital Pins and ' + \
+                         str(len(self.analog_pins)) + ' Analog Pins'
+            logging.info(log_string)
+        else:
+            print('{} {} {} {} {}'.format('Auto-discovery complete. Found',
+                                          len(self.digital_pins),
+                                          'Digital Pins and',
+                                          len(self.analog_pins),
+                                          'Analog Pins\n\n'))
+
+    def _redundant_write(self, kind, key, value, force):
+        """
+        This is a private utility method.
+        It records the value being written to an output and, when
+        suppress_redundant_writes is set, reports whether the write can be
+        skipped because the value is the last one sent.
+
+        :param kind: 'analog', 'digital_pin' or 'digital_port'
+        :param key: Pin or port number
+        :param value: Value to be written
+        :param force: True if the write must be sent
+        :returns: True if the write should be skipped
+        """
+        last_values = self._last_writes[kind]
+        if self.suppress_redundant_writes and not force and \
+                last_values.get(key) == value:
+            self.suppressed_writes[kind] += 1
+            return True
+        last_values[key] = value
+        return False
+
+    def _forget_writes(self, pin):
+        """
+        This is a private utility method.
+        It discards the last values sent to a pin when its mode changes,
+        along with any output value for the pin that is still queued or
+        held back by the rate limit, so it cannot follow the mode change.
+
+        :param pin: Pin number
+        :returns: No return value.
+        """
+        self._last_writes['analog'].pop(pin, None)
+        self._last_writes['digital_pin'].pop(pin, None)
+        self._last_writes['digital_port'].pop(pin // 8, None)
+
+        self._drop_output(pin)
+
+    def _set_transport(self, transport):
+        """
+        This is a private utility method.
+        It points read, read_bytes and write at the selected transport,
+        through a PymataRecorder if record_file was specified.
+
+        :param transport: PymataSerial, PymataSocket or user transport
+        :returns: No return value.
+        """
+        if self.record_file:
+            self.recorder = PymataRecorder(self.record_file, transport.read,
+                                           transport.read_bytes,
+                                           transport.write)
+            transport = self.recorder
+        self.read = transport.read
+        self.read_bytes = transport.read_bytes
+        self.write = transport.write
+
+    def _cache_key(self):
+        """
+        This is a private utility method.
+
+        :returns: The board cache key for the current connection
+        """
+        if self.transport is not None:
+            return type(self.transport).__name__
+        if self.ip_address:
+            return self.ip_address + ':' + str(self.ip_port)
+        return self.com_port
+
+    def _load_cached_board(self, firmware_version):
+        """
+        This is a private utility method.
+        It retrieves the cached board description for the current
+        connection and the firmware the board reported.
+
+        :param firmware_version: firmware ID string, None if the board
+                                 did not answer
+        :returns: Cache entry or None
+        """
+        if not self.board_cache or not firmware_version:
+            return None
+        entry = self.board_cache.load(self._cache_key(), firmware_version)
+        if not entry or not entry.get('analog_map'):
+            return None
+        if self.log_output:
+            logging.info('Using cached board description: ' +
+                         str(entry.get('firmware_id')))
+        else:
+            print('\nUsing cached board description: ' +
+                  str(entry.get('firmware_id')))
+        return entry
+
+    async def _wait_for_board(self):
+        """
+        This is a private utility method.
+        It waits for the board to finish any reset cycle by sending
+        firmware queries at short intervals until one is answered.
+        The event loop is never blocked while waiting.
+
+        :returns: Firmware version or None if the board did not answer
+                  within arduino_wait + query_timeout seconds
+        """
+        deadline = self.loop.time() + self.arduino_wait + self.query_timeout
+        while True:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                return None
+            firmware_version = await self.get_firmware_version(
+                min(PrivateConstants.READY_PROBE_INTERVAL, remaining))
+            if firmware_version:
+                return firmware_version
+
+    async def _update_board_cache(self, firmware_version, report):
+        """
+        This is a private utility method.
+        It retrieves the capability report and saves the board description
+        in the board cache.
+
+        :param firmware_version: firmware ID string
+        :param report: analog map report
+        :returns: No return value.
+        """
+        capability_report = await self.get_capability_report()
+        self.board_cache.save(self._cache_key(), firmware_version, report,
+                              capability_report)
+
+    async def _verify_cached_board(self, cached_board, firmware_version):
+        """
+        This is a private utility method.
+        It runs in the background after a cached start up. If the analog
+        map reported by the board differs from the cache, the pin lists and
+        the cache are updated.
+
+        :param cached_board: Cache entry used for start up
+        :param firmware_version: firmware ID string reported by the board
+        :returns: No return value.
+        """
+        report = await self.get_analog_map()
+        if not report:
+            if self.log_output:
+                logging.info('Cached board description could not be '
+                             'verified - analog map retrieval timed out.')
+            else:
+                print('Cached board description could not be verified - '
+                      'analog map retrieval timed out.')
+            return
+
+        if list(report) == cached_board.get('analog_map'):
+            return
+
+        if self.log_output:
+            logging.info('Cached board description is out of date - '
+                         'updating.')
+        else:
+            print('Cached board description is out of date - updating.')
+        self._build_pin_lists(report)
+        await self._update_board_cache(firmware_version, report)
+
     async def _check_latch_data(self, key, data):
         """
         This is a private utility method.
@@ -1690,55 +2431,65 @@ class PymataCore:
                 latching_entry[Constants.LATCHED_DATA] = data
                 await self._process_latching(key, latching_entry)
 
-    # noinspection PyMethodMayBeStatic
     def _discover_port(self):
         """
         This is a private utility method.
         This method attempts to discover the com port that the arduino
         is connected to.
+        The USB serial ports of Arduino compatible boards are probed
+        concurrently, and a port is only accepted if a Firmata board
+        answers a firmware query on it. Every board found is listed in
+        discovered_boards. When a board cache is in use and the port used
+        last time is still present, that port is chosen without probing
+        it, so that the board is opened, and reset, only once. start()
+        checks that it answers.
 
         :returns: Detected Comport
         """
-        # if MAC get list of ports
-        if sys.platform.startswith('darwin'):
-            locations = glob.glob('/dev/tty.[usb*]*')
-            locations = glob.glob('/dev/tty.[wchusb*]*') + locations
-            locations.append('end')
-        # for everyone else, here is a list of possible ports
-        else:
-            locations = ['dev/ttyACM0', '/dev/ttyACM0', '/dev/ttyACM1',
-                         '/dev/ttyACM2', '/dev/ttyACM3', '/dev/ttyACM4',
-                         '/dev/ttyACM5', '/dev/ttyUSB0', '/dev/ttyUSB1',
-                         '/dev/ttyUSB2', '/dev/ttyUSB3', '/dev/ttyUSB4',
-                         '/dev/ttyUSB5', '/dev/ttyUSB6', '/dev/ttyUSB7',
-                         '/dev/ttyUSB8', '/dev/ttyUSB9',
-                         '/dev/ttyUSB10',
-                         '/dev/ttyS0', '/dev/ttyS1', '/dev/ttyS2',
-                         '/dev/tty.usbserial', '/dev/tty.usbmodem', 'com2',
-                         'com3', 'com4', 'com5', 'com6', 'com7', 'com8',
-                         'com9', 'com10', 'com11', 'com12', 'com13',
-                         'com14', 'com15', 'com16', 'com17', 'com18',
-                         'com19', 'com20', 'com21', 'com1', 'end'
-                         ]
-
-        detected = None
-        for device in locations:
-            try:
-                serialport = serial.Serial(device, 57600, timeout=0)
-                detected = device
-                serialport.close()
-                break
-            except serial.SerialException:
-                if device == 'end':
-                    if self.log_output:
-                        logging.exception(
-                            'Unable to find Serial Port, Please plug in '
-                            'cable or check cable connections.')
-                    else:
-                        print('Unable to find Serial Port, Please plug in '
-                              'cable or check cable connections.')
-                    detected = None
-                    exit()
+        ports = port_discovery.list_serial_ports()
+        boards = []
+        last_port = None
+        if self.board_cache:
+            last_port = self.board_cache.get_value('last_port')
+            if last_port in ports:
+                ports.remove(last_port)
+                boards.append((last_port, None))
+            else:
+                last_port = None
+
+        if self.probe_ports:
+            boards += port_discovery.discover_boards(
+                ports, 57600, self.arduino_wait, self.query_timeout)
+        elif ports and not boards:
+            boards.append((ports[0], None))
+
+        if not boards:
+            if self.log_output:
+                logging.exception(
+                    'Unable to find Serial Port, Please plug in '
+                    'cable or check cable connections.')
+            else:
+                print('Unable to find Serial Port, Please plug in '
+                      'cable or check cable connections.')
+            if not self.exit_on_error:
+                raise RuntimeError('Unable to find Serial Port')
+            exit()
+
+        self.discovered_boards = boards
+        if len(boards) > 1:
+            for port, firmware in boards:
+                if firmware is None:
+                    firmware = 'last port used, not probed'
+                if self.log_output:
+                    logging.info('Found Firmata board on ' + port + ': ' +
+                                 firmware)
+                else:
+                    print('Found Firmata board on ' + port + ': ' + firmware)
+
+        detected = boards[0][0]
+        if self.board_cache and detected != last_port:
+            self.board_cache.set_value('last_port', detected)
+
         if self.log_output:
             log_string = 'Using COM Port: ' + detected
             logging.info(log_string)
@@ -1815,64 +2566,396 @@ class PymataCore:
             updated_latch_entry[Constants.LATCHED_TIME_STAMP] = time.time()
             self.latch_map[key] = updated_latch_entry
 
-    async def _send_command(self, command):
+    async def _query(self, key, request, timeout=None):
+        """
+        This is a private utility method.
+        It sends a query to Firmata and waits for the reply to be
+        delivered by the matching message handler.
+        Several queries with the same key may be in flight at once. Replies
+        are matched to queries in the order the queries were sent.
+
+        :param key: The reply message type, i.e. REPORT_FIRMWARE, or for
+                    pin state queries, (PIN_STATE_RESPONSE, pin)
+        :param request: Coroutine that sends the query
+        :param timeout: Seconds to wait for the reply. None selects
+                        query_timeout.
+        :returns: The reply data or None if a timeout occurs
+        """
+        if timeout is None:
+            timeout = self.query_timeout
+        future = self._register_query(key)
+        try:
+            await request
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            if key in self._held_replies:
+                return self._held_replies.pop(key)
+            self._expect_late_reply(key)
+            return None
+        finally:
+            self._unregister_query(key, future)
+
+    def _expect_late_reply(self, key):
+        """
+        This is a private utility method.
+        It is called when a query times out. Firmata answers queries in
+        the order they are sent, so while the query is outstanding the
+        next pin state or i2c reply with its key is its late reply, which
+        would hand old data to a newer query. That reply is discarded, or
+        held for a newer query - see _query_reply().
+        Board description replies, such as the firmware version, are the
+        same every time and are left for the next query.
+
+        :param key: Query key - see _query()
+        :returns: No return value.
+        """
+        if isinstance(key, tuple):
+            self._late_replies[key] = self._late_replies.get(key, 0) + 1
+
+    def _query_reply(self, reply_type, data, key=None):
+        """
+        This is a private utility method.
+        It saves reply data in query_reply_data and completes the oldest
+        query waiting for this reply.
+
+        :param reply_type: The reply message type, i.e. REPORT_FIRMWARE
+        :param data: The reply data
+        :param key: Key of the waiting queries if it is not the reply type
+        :returns: No return value.
+        """
+        if key is None:
+            key = reply_type
+        late = self._late_replies.get(key)
+        if late:
+            # the oldest outstanding query has timed out, so this is
+            # taken to be its reply
+            if late == 1:
+                del self._late_replies[key]
+            else:
+                self._late_replies[key] = late - 1
+            if self._pending_queries.get(key):
+                # the board may have dropped the query that timed out, so
+                # keep the reply for the waiting query in case no newer
+                # reply arrives
+                self._held_replies[key] = data
+            return
+        self.query_reply_data[reply_type] = data
+        pending = self._pending_queries.get(key)
+        while pending:
+            future = pending.pop(0)
+            if not future.done():
+                self._held_replies.pop(key, None)
+                future.set_result(data)
+                break
+
+    def _register_query(self, key):
+        """
+        This is a private utility method.
+        It creates the future that will receive the reply to a query.
+
+        :param key: Query key - see _query()
+        :returns: An asyncio Future
+        """
+        future = asyncio.Future()
+        self._pending_queries.setdefault(key, []).append(future)
+        return future
+
+    def _unregister_query(self, key, future):
+        """
+        This is a private utility method.
+        It removes a query future that is no longer being waited on.
+
+        :param key: Query key - see _query()
+        :param future: Future returned by _register_query()
+        :returns: No return value.
+        """
+        pending = self._pending_queries.get(key)
+        if pending and future in pending:
+            pending.remove(future)
+        if not pending:
+            self._pending_queries.pop(key, None)
+
+    async def _queue_frame(self, frame, immediate=False, output=None,
+                           priority=None):
+        """
+        This is a private utility method.
+        It hands a complete Firmata frame to the transport. If write
+        batching is enabled, the frame is added to the queue for its
+        priority class and a flush is scheduled for the end of the
+        batching window.
+
+        :param frame: bytes or bytearray
+        :param immediate: If True, queued control frames and then the
+                          frame are written now, regardless of batching.
+        :param output: Pin number for analog output frames, which may be
+                       coalesced or rate limited. None for other frames.
+        :param priority: Priority class of the frame. None looks it up in
+                         frame_priorities.
+        :returns: Number of bytes written or None if the frame was queued
+        """
+        if priority is None:
+            command = frame[0]
+            if command == PrivateConstants.START_SYSEX:
+                command = frame[1]
+            elif command < PrivateConstants.START_SYSEX:
+                command &= 0xf0
+            priority = self.frame_priorities.get(command,
+                                                 Constants.PRIORITY_CONTROL)
+
+        if priority == Constants.PRIORITY_SAFETY:
+            if output is not None:
+                # a held back older value must not follow this one
+                self._drop_output(output)
+            # safety frames are never rate limited or queued
+            return await self._write_barrier(frame)
+
+        if output is not None and self.max_output_rate:
+            now = self.loop.time()
+            release = self._output_times.get(output, -1e9) + \
+                1 / self.max_output_rate
+            deferred = self._deferred_outputs.get(output)
+            if deferred:
+                # replace the frame already waiting for the release time
+                deferred[0] = frame
+                self.coalesced_writes += 1
+                return None
+            if now < release:
+                handle = self.loop.call_later(release - now,
+                                              self._release_output, output)
+                self._deferred_outputs[output] = [frame, handle]
+                return None
+            self._output_times[output] = now
+
+        if self.write_batch_window is None and not any(self._write_queues):
+            return await self.write(frame)
+
+        if immediate:
+            return await self._write_barrier(frame)
+
+        queue = self._write_queues[priority]
+
+        if output is not None and self.coalesce_outputs:
+            queued = self._queued_outputs.get(output)
+            if queued is not None:
+                # drop the older value; the new frame goes to the end of
+                # the queue so it follows any pin mode change queued since
+                self._write_queues[queued[0]][queued[1]] = b''
+                self.coalesced_writes += 1
+            self._queued_outputs[output] = (priority, len(queue))
+
+        queue.append(frame)
+        if self.write_batch_window is None:
+            return await self.flush_writes()
+
+        self._schedule_flush()
+
+    async def _write_barrier(self, frame):
+        """
+        This is a private utility method.
+        It writes the queued safety and control frames followed by the
+        frame in a single write, so that a reset or stop is never followed
+        by older outputs. Queued bulk frames are left for the next flush,
+        so they cannot delay the frame.
+
+        :param frame: bytes or bytearray
+        :returns: Number of bytes written
+        """
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        safety, control, bulk = self._write_queues
+        frames = safety + control
+        del safety[:]
+        del control[:]
+        self._queued_outputs = {
+            output: queued for output, queued in self._queued_outputs.items()
+            if queued[0] == Constants.PRIORITY_BULK}
+        frames.append(frame)
+        result = await self.write(b''.join(frames))
+        if bulk:
+            self._schedule_flush()
+        return result
+
+    def _drop_output(self, output):
+        """
+        This is a private utility method.
+        It discards any value for an output pin that is still queued or
+        held back by the rate limit.
+
+        :param output: Pin number
+        :returns: No return value.
+        """
+        deferred = self._deferred_outputs.pop(output, None)
+        if deferred:
+            deferred[1].cancel()
+        queued = self._queued_outputs.pop(output, None)
+        if queued is not None:
+            self._write_queues[queued[0]][queued[1]] = b''
+
+    def _port_priority(self, port, mask):
+        """
+        This is a private utility method.
+        It returns the highest priority set with set_output_priority for
+        the pins of a port selected by mask.
+
+        :param port: Port number
+        :param mask: Bit mask of port pins
+        :returns: Priority class or None
+        """
+        priorities = [self.output_priorities[port * 8 + bit]
+                      for bit in range(8)
+                      if mask & (1 << bit) and
+                      port * 8 + bit in self.output_priorities]
+        if priorities:
+            return min(priorities)
+        return None
+
+    def _schedule_flush(self):
+        """
+        This is a private utility method.
+        It schedules a flush of the write queues at the end of the write
+        batching window, unless one is already scheduled.
+
+        :returns: No return value.
+        """
+        if not self._flush_handle:
+            if self.write_batch_window:
+                self._flush_handle = self.loop.call_later(
+                    self.write_batch_window / 1000000, self._scheduled_flush)
+            else:
+                self._flush_handle = self.loop.call_soon(
+                    self._scheduled_flush)
+
+    def _release_output(self, output):
+        """
+        This is a private utility method.
+        It is called by the event loop when a rate limited output may be
+        updated again, and sends the newest value held back for it.
+
+        :param output: Pin number
+        :returns: No return value.
+        """
+        frame, handle = self._deferred_outputs.pop(output)
+        self._start_write_task(self._queue_frame(frame, output=output))
+
+    def _scheduled_flush(self):
+        """
+        This is a private utility method.
+        It is called by the event loop when the write batching window
+        expires.
+
+        :returns: No return value.
+        """
+        self._flush_handle = None
+        self._start_write_task(self.flush_writes())
+
+    def _start_write_task(self, coroutine):
+        """
+        This is a private utility method.
+        It runs a write that was scheduled by the event loop, so that no
+        caller is waiting for it, and reports it if it fails.
+
+        :param coroutine: Write coroutine
+        :returns: No return value.
+        """
+        task = self.loop.create_task(coroutine)
+        self._write_tasks.add(task)
+        task.add_done_callback(self._write_task_done)
+
+    def _write_task_done(self, task):
+        """
+        This is a private utility method.
+        It is called when a scheduled write completes. A failed write is
+        logged. The board is then closed if exit_on_error is False, or
+        shut down if it is True.
+
+        :param task: Completed write task
+        :returns: No return value.
+        """
+        self._write_tasks.discard(task)
+        if task.cancelled() or task.exception() is None:
+            return
+        ex = task.exception()
+        if self.log_output:
+            logging.error('Scheduled write failed: ' + str(ex))
+        else:
+            print('Scheduled write failed: ' + str(ex))
+        if self.closed:
+            return
+        if not self.exit_on_error:
+            # stop this board only
+            self.error = ex
+            self.loop.create_task(self.close())
+        else:
+            self.loop.create_task(self.shutdown())
+
+    async def _send_command(self, command, immediate=False, output=None,
+                            priority=None):
         """
         This is a private utility method.
         The method sends a non-sysex command to Firmata.
+        The command is written to the transport as a single frame.
 
         :param command:  command data
+        :param immediate: If True, bypass write batching
+        :param output: Pin number for analog output commands
+        :param priority: Priority class. None uses frame_priorities.
         :returns: length of data sent
         """
-        send_message = ""
-
-        for i in command:
-            send_message += chr(i)
         result = None
-        for data in send_message:
-            try:
-                result = await self.write(data)
-            except():
-                if self.log_output:
-                    logging.exception('cannot send command')
-                else:
-                    print('cannot send command')
+        try:
+            result = await self._queue_frame(bytes(command), immediate,
+                                             output, priority)
+        except():
+            if self.log_output:
+                logging.exception('cannot send command')
+            else:
+                print('cannot send command')
         return result
 
-    async def _send_sysex(self, sysex_command, sysex_data=None):
+    async def _send_digital_port(self, port, force=False, priority=None):
         """
         This is a private utility method.
-        This method sends a sysex command to Firmata.
+        It sends the output shadow value of a digital port to Firmata.
 
-        :param sysex_command: sysex command
-        :param sysex_data: data for command
-        :returns : No return value.
+        :param port: Port number
+        :param force: Send the port even if it is the last value sent
+        :param priority: Priority class. None uses frame_priorities.
+        :returns: No return value.
         """
-        if not sysex_data:
-            sysex_data = []
+        if self._redundant_write('digital_port', port,
+                                 self.digital_output_port_pins[port], force):
+            return
+        # the pin values last sent no longer describe this port
+        pin_writes = self._last_writes['digital_pin']
+        for pin in range(port * 8, port * 8 + 8):
+            pin_writes.pop(pin, None)
 
-        # convert the message command and data to characters
-        sysex_message = chr(PrivateConstants.START_SYSEX)
-        sysex_message += chr(sysex_command)
-        if len(sysex_data):
-            for d in sysex_data:
-                sysex_message += chr(d)
-        sysex_message += chr(PrivateConstants.END_SYSEX)
+        command = (PrivateConstants.DIGITAL_MESSAGE + port,
+                   self.digital_output_port_pins[port] & 0x7f,
+                   (self.digital_output_port_pins[port] >> 7) & 0x7f)
 
-        for data in sysex_message:
-            await self.write(data)
+        await self._send_command(command, priority=priority)
 
-    async def _wait_for_data(self, current_command, number_of_bytes):
+    async def _send_sysex(self, sysex_command, sysex_data=None,
+                          immediate=False, output=None, priority=None):
         """
         This is a private utility method.
-        This method accumulates the requested number of bytes and
-        then returns the full command
-
-        :param current_command:  command id
-        :param number_of_bytes:  how many bytes to wait for
-        :returns: command
-        """
-        while number_of_bytes:
-            next_command_byte = await self.read()
-            current_command.append(next_command_byte)
-            number_of_bytes -= 1
-        return current_command
+        This method sends a sysex command to Firmata.
+        The complete sysex message is written to the transport as a
+        single frame.
+
+        :param sysex_command: sysex command
+        :param sysex_data: data for command
+        :param immediate: If True, bypass write batching
+        :param output: Pin number for analog output messages
+        :param priority: Priority class. None uses frame_priorities.
+        :returns : No return value.
+        """
+        sysex_message = bytearray((PrivateConstants.START_SYSEX,
+                                   sysex_command))
+        if sysex_data:
+            sysex_message.extend(sysex_data)
+        sysex_message.append(PrivateConstants.END_SYSEX)
+
+        await self._queue_frame(sysex_message, immediate, output, priority)
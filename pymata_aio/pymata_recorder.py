@@ -0,0 +1,279 @@
+"""
+Copyright (c) 2016 Alan Yorinks All rights reserved.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU  General Public
+License as published by the Free Software Foundation; either
+version 3 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""
+
+import asyncio
+import struct
+import time
+
+# file signature written at the start of every recording
+RECORDING_SIGNATURE = b'PYMATA-REC1\n'
+
+# each chunk is stored as a header followed by the chunk data.
+# header: direction (1 byte), seconds since the start of the
+# recording (8 byte float), data length (4 bytes)
+CHUNK_HEADER = struct.Struct('<BdI')
+
+# chunk directions
+RECEIVED = 0
+SENT = 1
+
+
+def read_recording(file_name):
+    """
+    Load a recording made by PymataRecorder.
+
+    :param file_name: Recording file
+    :returns: A list of (direction, time stamp, data) tuples
+    """
+    chunks = []
+    with open(file_name, 'rb') as recording:
+        if recording.read(len(RECORDING_SIGNATURE)) != RECORDING_SIGNATURE:
+            raise ValueError(file_name + ' is not a pymata_aio recording')
+        while True:
+            header = recording.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                break
+            direction, time_stamp, length = CHUNK_HEADER.unpack(header)
+            data = recording.read(length)
+            if len(data) < length:
+                break
+            chunks.append((direction, time_stamp, data))
+    return chunks
+
+
+class PymataRecorder:
+    """
+    This class wraps a transport's read, read_bytes and write coroutines
+    and records every chunk received and sent, with a monotonic time
+    stamp, in a compact binary file. The recording can be played back
+    with PymataReplay.
+    """
+
+    def __init__(self, file_name, read, read_bytes, write):
+        """
+        :param file_name: Recording file. It is overwritten.
+        :param read: Transport read coroutine function
+        :param read_bytes: Transport read_bytes coroutine function
+        :param write: Transport write coroutine function
+        """
+        self.file_name = file_name
+        self.transport_read = read
+        self.transport_read_bytes = read_bytes
+        self.transport_write = write
+        self.recording = open(file_name, 'wb')
+        self.recording.write(RECORDING_SIGNATURE)
+        self.start_time = time.monotonic()
+
+    async def read(self):
+        """
+        Read and record a single byte
+
+        :return: Next byte
+        """
+        data = await self.transport_read()
+        self._record(RECEIVED, bytes([data]))
+        return data
+
+    async def read_bytes(self):
+        """
+        Read and record a chunk of data
+
+        :return: bytes read
+        """
+        data = await self.transport_read_bytes()
+        self._record(RECEIVED, data)
+        return data
+
+    async def write(self, data):
+        """
+        Record and write a chunk of data
+
+        :param data: bytes or bytearray
+        :return: Number of bytes written
+        """
+        self._record(SENT, data)
+        return await self.transport_write(data)
+
+    def close(self):
+        """
+        Close the recording file
+
+        :returns: No return value.
+        """
+        if not self.recording.closed:
+            self.recording.close()
+
+    def _record(self, direction, data):
+        """
+        Append a chunk to the recording
+
+        :param direction: RECEIVED or SENT
+        :param data: chunk data
+        :returns: No return value.
+        """
+        if self.recording.closed:
+            return
+        self.recording.write(CHUNK_HEADER.pack(
+            direction, time.monotonic() - self.start_time, len(data)))
+        self.recording.write(data)
+
+
+class PymataReplay:
+    """
+    This class is a transport that plays back a recording made by
+    PymataRecorder. The received chunks are fed to PymataCore and
+    anything PymataCore writes is counted and discarded.
+
+    When follow_writes is True, a received chunk is not delivered until
+    the client has written as many bytes as had been sent before it in
+    the recording, so replies never arrive ahead of the queries that
+    caused them. Byte counts are compared rather than write calls, since
+    write batching may group the same data differently. If the client
+    sends less data than the recording, for example fewer readiness
+    probes, the chunk is delivered after write_timeout seconds.
+    """
+
+    def __init__(self, file_name, speed=1.0, follow_writes=True,
+                 write_timeout=1.0):
+        """
+        :param file_name: Recording file
+        :param speed: 1.0 replays with the original timing, 2.0 twice as
+                      fast. None replays as fast as possible.
+        :param follow_writes: Hold each received chunk until the client has
+                              written the data that preceded it
+        :param write_timeout: Longest time in seconds a chunk is held
+                              waiting for the client's writes
+        """
+        self.chunks = read_recording(file_name)
+        self.speed = speed
+        self.follow_writes = follow_writes
+        self.write_timeout = write_timeout
+
+        self.index = 0
+        self.writes = 0
+        self.expected_bytes = 0
+        self.bytes_written = 0
+        # recorded bytes the client never wrote before a write_timeout
+        self.missing_bytes = 0
+        self.start_time = None
+        self.rx_buffer = bytearray()
+        self.rx_index = 0
+        self._write_event = None
+        self.finished = None
+
+    async def read(self):
+        """
+        Return the next recorded byte
+
+        :return: Next byte
+        """
+        if self.rx_index >= len(self.rx_buffer):
+            del self.rx_buffer[:]
+            self.rx_index = 0
+            self.rx_buffer += await self._next_chunk()
+        data = self.rx_buffer[self.rx_index]
+        self.rx_index += 1
+        return data
+
+    async def read_bytes(self):
+        """
+        Return the next recorded chunk
+
+        :return: bytes read
+        """
+        if self.rx_index < len(self.rx_buffer):
+            data = bytes(self.rx_buffer[self.rx_index:])
+            del self.rx_buffer[:]
+            self.rx_index = 0
+            return data
+        return await self._next_chunk()
+
+    async def write(self, data):
+        """
+        Count and discard data written by the client
+
+        :param data: bytes or bytearray
+        :return: Number of bytes written
+        """
+        self._start()
+        self.writes += 1
+        self.bytes_written += len(data)
+        self._write_event.set()
+        return len(data)
+
+    def _start(self):
+        """
+        Start the replay clock when the replay is first used
+
+        :returns: No return value.
+        """
+        if self.start_time is None:
+            self.start_time = asyncio.get_event_loop().time()
+            self._write_event = asyncio.Event()
+            self.finished = asyncio.Future()
+
+    async def _wait_for_writes(self):
+        """
+        Wait until the client has written the data recorded before the
+        next received chunk, or until write_timeout expires. After a
+        timeout the missing data is written off, so later chunks are not
+        held for it again.
+
+        :returns: No return value.
+        """
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.write_timeout
+        while self.bytes_written + self.missing_bytes < self.expected_bytes:
+            remaining = deadline - loop.time()
+            if remaining > 0:
+                self._write_event.clear()
+                try:
+                    await asyncio.wait_for(self._write_event.wait(),
+                                           remaining)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+            self.missing_bytes = self.expected_bytes - self.bytes_written
+            return
+
+    async def _next_chunk(self):
+        """
+        Wait for the next received chunk to become due
+
+        :return: chunk data
+        """
+        self._start()
+        while self.index < len(self.chunks):
+            direction, time_stamp, data = self.chunks[self.index]
+            self.index += 1
+            if direction == SENT:
+                self.expected_bytes += len(data)
+                continue
+            if self.follow_writes:
+                await self._wait_for_writes()
+            if self.speed:
+                delay = self.start_time + time_stamp / self.speed - \
+                    asyncio.get_event_loop().time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            return data
+
+        # the recording is exhausted - behave like a silent board
+        if not self.finished.done():
+            self.finished.set_result(True)
+        await asyncio.Future()
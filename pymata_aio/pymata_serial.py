@@ -32,12 +32,19 @@ class PymataSerial:
     """
 
     def __init__(self, com_port='/dev/ttyACM0', speed=57600, sleep_tune=.001,
-                 log_output=False):
+                 log_output=False, event_driven=False, exit_on_error=True):
         """
         This is the constructor for the aio serial handler
 
         :param com_port: Com port designator
         :param speed: baud rate
+        :param event_driven: If True, the serial port file descriptor is
+                             registered with the event loop and reads wake
+                             up only when data arrives. If False, inWaiting()
+                             is polled every sleep_tune seconds.
+        :param exit_on_error: If False, a write error closes the port and
+                              raises the exception instead of stopping the
+                              event loop and exiting.
         :return: None
         """
         self.log_output = log_output
@@ -51,6 +58,13 @@ class PymataSerial:
 
         self.com_port = com_port
         self.sleep_tune = sleep_tune
+        self.event_driven = event_driven
+        self.exit_on_error = exit_on_error
+
+        # bytes drained from the serial port and the index of the
+        # next byte to be consumed
+        self.rx_buffer = bytearray()
+        self.rx_index = 0
 
     def get_serial(self):
         """
@@ -65,22 +79,22 @@ class PymataSerial:
         """
         This is an asyncio adapted version of pyserial write. It provides a
         non-blocking  write and returns the number of bytes written upon
-        completion
+        completion. The entire buffer is handed to pyserial in one call.
 
-        :param data: Data to be written
+        :param data: Data to be written - bytes or bytearray
         :return: Number of bytes written
         """
-        # the secret sauce - it is in your future
-        future = asyncio.Future()
         result = None
         try:
-            result = self.my_serial.write(bytes([ord(data)]))
+            result = self.my_serial.write(data)
         except serial.SerialException:
+            if not self.exit_on_error:
+                self.my_serial.close()
+                raise
             # self.my_serial.close()
             # noinspection PyBroadException
             try:
                 await self.close()
-                future.cancel()
                 if self.log_output:
                     logging.exception('Write exception')
                 else:
@@ -97,15 +111,7 @@ class PymataSerial:
             except:  # swallow any additional exceptions during shutdown
                 pass
 
-        if result:
-            future.set_result(result)
-            while True:
-                if not future.done():
-                    # spin our asyncio wheels until future completes
-                    await asyncio.sleep(self.sleep_tune)
-
-                else:
-                    return future.result()
+        return result
 
     async def readline(self):
         """
@@ -114,21 +120,13 @@ class PymataSerial:
 
         :return: A line of data
         """
-        future = asyncio.Future()
-        data_available = False
         while True:
-            if not data_available:
-                if not self.my_serial.inWaiting():
-                    await asyncio.sleep(self.sleep_tune)
-                else:
-                    data_available = True
-                    data = self.my_serial.readline()
-                    future.set_result(data)
-            else:
-                if not future.done():
-                    await asyncio.sleep(self.sleep_tune)
-                else:
-                    return future.result()
+            end = self.rx_buffer.find(b'\n', self.rx_index)
+            if end != -1:
+                line = bytes(self.rx_buffer[self.rx_index:end + 1])
+                self.rx_index = end + 1
+                return line
+            await self._fill_buffer()
 
     async def read(self):
         """
@@ -137,37 +135,77 @@ class PymataSerial:
 
         :return: One character
         """
+        if self.rx_index >= len(self.rx_buffer):
+            await self._fill_buffer()
+        data = self.rx_buffer[self.rx_index]
+        self.rx_index += 1
+        return data
 
-        # create an asyncio Future
-        future = asyncio.Future()
+    async def read_bytes(self):
+        """
+        Return all of the data currently held in the receive buffer,
+        waiting until at least one byte is available.
+
+        :return: bytes read
+        """
+        if self.rx_index >= len(self.rx_buffer):
+            await self._fill_buffer()
+        with memoryview(self.rx_buffer) as view:
+            data = bytes(view[self.rx_index:])
+        del self.rx_buffer[:]
+        self.rx_index = 0
+        return data
+
+    async def _fill_buffer(self):
+        """
+        Wait for data to arrive on the serial port and then drain
+        everything the port has waiting into the receive buffer
+        with a single read.
 
-        # create a flag to indicate when data becomes available
-        data_available = False
+        :return: None
+        """
+        # discard data that has already been consumed
+        if self.rx_index >= len(self.rx_buffer):
+            del self.rx_buffer[:]
+            self.rx_index = 0
 
-        # wait for a character to become available and read from
-        # the serial port
         while True:
-            if not data_available:
-                # test to see if a character is waiting to be read.
-                # if not, relinquish control back to the event loop through the
-                # short sleep
-                if not self.my_serial.inWaiting():
-                    await asyncio.sleep(self.sleep_tune)
-                # data is available.
-                # set the flag to true so that the future can "wait" until the
-                # read is completed.
-                else:
-                    data_available = True
-                    data = self.my_serial.read()
-                    # set future result to make the character available
-                    future.set_result(ord(data))
+            waiting = self.my_serial.inWaiting()
+            if waiting:
+                self.rx_buffer += self.my_serial.read(waiting)
+                return
+            # relinquish control back to the event loop until data arrives
+            if self.event_driven:
+                await self._wait_readable()
             else:
-                # wait for the future to complete
-                if not future.done():
-                    await asyncio.sleep(self.sleep_tune)
-                else:
-                    # future is done, so return the character
-                    return future.result()
+                await asyncio.sleep(self.sleep_tune)
+
+    async def _wait_readable(self):
+        """
+        Suspend until the event loop reports that the serial port
+        file descriptor is readable. The reader is registered only for
+        the duration of the wait, so an idle port costs no wakeups.
+
+        :return: None
+        """
+        loop = asyncio.get_event_loop()
+        future = asyncio.Future()
+        fd = self.my_serial.fileno()
+        loop.add_reader(fd, self._readable, future)
+        try:
+            await future
+        finally:
+            loop.remove_reader(fd)
+
+    @staticmethod
+    def _readable(future):
+        """
+        Event loop reader callback - wakes up _wait_readable()
+
+        :param future: future being awaited by _wait_readable()
+        """
+        if not future.done():
+            future.set_result(True)
 
     async def close(self):
         """
@@ -0,0 +1,563 @@
+"""
+Copyright (c) 2016 Alan Yorinks All rights reserved.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU  General Public
+License as published by the Free Software Foundation; either
+version 3 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""
+
+import asyncio
+
+from pymata_aio.constants import Constants
+from pymata_aio.firmata_parser import FirmataParser
+from pymata_aio.private_constants import PrivateConstants
+
+
+class PymataSimulator:
+    """
+    This class is an in-process simulated FirmataPlus board. It provides
+    the same read, read_bytes and write coroutines as PymataSerial and
+    PymataSocket, and is used by passing it to PymataCore as the
+    transport parameter.
+
+    The simulator answers version, firmware, capability, analog map and
+    pin state queries, sends analog and digital reports for the pins that
+    have reporting enabled, and emulates the FirmataPlus sonar, encoder,
+    pixy, stepper and tone extensions, as well as i2c reads.
+
+    Input values are supplied with set_analog_input(), set_digital_input(),
+    set_sonar_distance(), set_encoder_position(), set_pixy_blocks() and
+    set_i2c_data(). Outputs written by the client are available in
+    pin_values, pin_modes, tones, stepper_position and pixy_settings.
+    """
+
+    # number of data bytes following each command byte sent by the client
+    CLIENT_DATA_LENGTHS = {PrivateConstants.DIGITAL_MESSAGE: 2,
+                           PrivateConstants.ANALOG_MESSAGE: 2,
+                           PrivateConstants.REPORT_ANALOG: 1,
+                           PrivateConstants.REPORT_DIGITAL: 1,
+                           PrivateConstants.SET_PIN_MODE: 2,
+                           PrivateConstants.SET_DIGITAL_PIN_VALUE: 2,
+                           PrivateConstants.REPORT_VERSION: 0,
+                           PrivateConstants.SYSTEM_RESET: 0}
+
+    def __init__(self, digital_pins=20, analog_pins=6,
+                 pwm_pins=(3, 5, 6, 9, 10, 11), sampling_interval=19,
+                 speed=1.0, firmware_name='FirmataPlus.ino',
+                 firmware_version=(2, 5), analog_source=None,
+                 hall_encoder=False):
+        """
+        :param digital_pins: Total number of pins. The default is an Uno.
+        :param analog_pins: Number of analog inputs. They are the highest
+                            numbered pins.
+        :param pwm_pins: Pins that support PWM
+        :param sampling_interval: Initial sampling interval in milliseconds
+        :param speed: Simulation speed. 1.0 is wall clock time, 10.0 runs
+                      all reporting intervals 10 times faster.
+        :param firmware_name: Firmware name sent in the firmware report
+        :param firmware_version: (major, minor) firmware and protocol version
+        :param analog_source: Optional function called as
+                              analog_source(analog_pin, simulated_time) to
+                              generate analog input values. If not given,
+                              the values set by set_analog_input() are used.
+        :param hall_encoder: If True, encoder reports use the FirmataPlusRB
+                             two wheel hall effect encoder format
+        """
+        self.digital_pin_count = digital_pins
+        self.analog_pin_count = analog_pins
+        self.pwm_pins = pwm_pins
+        self.speed = speed
+        self.firmware_name = firmware_name
+        self.firmware_version = firmware_version
+        self.analog_source = analog_source
+        self.hall_encoder = hall_encoder
+        self.initial_sampling_interval = sampling_interval
+
+        self.parser = FirmataParser(self.CLIENT_DATA_LENGTHS)
+
+        # data waiting to be read by the client
+        self.rx_buffer = bytearray()
+        self.rx_index = 0
+        self._data_ready = None
+
+        self._task = None
+        self._start_time = 0
+
+        # statistics
+        self.bytes_written = 0
+        self.messages_received = 0
+
+        self._reset()
+
+    def _reset(self):
+        """
+        Return the simulated board to its power up state
+
+        :returns: No return value.
+        """
+        first_analog_pin = self.digital_pin_count - self.analog_pin_count
+        self.analog_map = [Constants.IGNORE] * first_analog_pin + \
+            list(range(self.analog_pin_count))
+
+        self.pin_modes = [Constants.OUTPUT] * first_analog_pin + \
+            [Constants.ANALOG] * self.analog_pin_count
+        self.pin_values = [0] * self.digital_pin_count
+
+        self.analog_inputs = [0] * self.analog_pin_count
+        self.digital_inputs = [0] * self.digital_pin_count
+
+        self.sampling_interval = self.initial_sampling_interval
+        self.analog_reporting = set()
+        self.digital_reporting = set()
+        # last digital port values sent, used to report only on change
+        self.reported_ports = {}
+
+        # i2c device data - {address: {register: [data bytes]}}
+        self.i2c_data = {}
+        # continuous i2c reads - {(address, register): number_of_bytes}
+        self.i2c_continuous_reads = {}
+
+        # sonar devices - {trigger_pin: [ping_interval, distance, next_ping]}
+        self.sonars = {}
+        # encoders - {pin_a: [pin_b, position_a, position_b]}
+        self.encoders = {}
+        # pixy reporting - None if not initialized, else max blocks
+        self.pixy_max_blocks = None
+        self.pixy_blocks = []
+        self.pixy_settings = {}
+        # tones - {pin: [frequency, duration]} for playing tones
+        self.tones = {}
+        # stepper
+        self.stepper_config = None
+        self.stepper_position = 0
+
+    def set_analog_input(self, pin, value):
+        """
+        Set the value reported for an analog input
+
+        :param pin: Analog pin number (A2 is 2)
+        :param value: 0 - 1023
+        :returns: No return value.
+        """
+        self.analog_inputs[pin] = value
+
+    def set_digital_input(self, pin, value):
+        """
+        Set the level of a digital input pin. If reporting is enabled for
+        the pin's port, a digital message is sent immediately.
+
+        :param pin: Pin number
+        :param value: 0 or 1
+        :returns: No return value.
+        """
+        self.digital_inputs[pin] = value
+        port = pin // 8
+        if port in self.digital_reporting:
+            self._report_digital_port(port)
+
+    def set_sonar_distance(self, trigger_pin, distance):
+        """
+        Set the distance reported by a sonar device
+
+        :param trigger_pin: Trigger pin given to sonar_config()
+        :param distance: Distance in centimeters
+        :returns: No return value.
+        """
+        if trigger_pin in self.sonars:
+            self.sonars[trigger_pin][1] = distance
+
+    def set_encoder_position(self, pin, position, position_b=0):
+        """
+        Set the position reported by an encoder
+
+        :param pin: Encoder pin_a given to encoder_config()
+        :param position: Encoder position (second encoder for hall encoders)
+        :param position_b: Position of the second hall effect encoder
+        :returns: No return value.
+        """
+        if pin in self.encoders:
+            self.encoders[pin][1] = position
+            self.encoders[pin][2] = position_b
+
+    def set_pixy_blocks(self, blocks):
+        """
+        Set the blocks reported by the Pixy camera.
+
+        :param blocks: A list of dictionaries with signature, x, y, width,
+                       height and angle entries
+        :returns: No return value.
+        """
+        self.pixy_blocks = blocks
+
+    def set_i2c_data(self, address, register, data):
+        """
+        Set the bytes returned when an i2c device register is read
+
+        :param address: i2c device address
+        :param register: register number
+        :param data: list of data bytes
+        :returns: No return value.
+        """
+        self.i2c_data.setdefault(address, {})[register] = list(data)
+
+    def simulated_time(self):
+        """
+        :returns: Simulated seconds since the simulator started
+        """
+        if not self._task:
+            return 0
+        return (asyncio.get_event_loop().time() - self._start_time) * \
+            self.speed
+
+    async def read(self):
+        """
+        This method reads one byte of data sent by the simulated board
+
+        :return: Next byte
+        """
+        if self.rx_index >= len(self.rx_buffer):
+            await self._wait_for_data()
+        data = self.rx_buffer[self.rx_index]
+        self.rx_index += 1
+        return data
+
+    async def read_bytes(self):
+        """
+        This method returns all of the data sent by the simulated board
+        that has not been read, waiting until at least one byte is available.
+
+        :return: bytes read
+        """
+        if self.rx_index >= len(self.rx_buffer):
+            await self._wait_for_data()
+        with memoryview(self.rx_buffer) as view:
+            data = bytes(view[self.rx_index:])
+        del self.rx_buffer[:]
+        self.rx_index = 0
+        return data
+
+    async def write(self, data):
+        """
+        This method processes data sent by the client as the board would.
+
+        :param data: bytes or bytearray
+        :return: Number of bytes written
+        """
+        self._start()
+        self.bytes_written += len(data)
+        for command, message in self.parser.feed(bytes(data)):
+            self.messages_received += 1
+            self._process_message(command, message)
+        return len(data)
+
+    async def close(self):
+        """
+        Stop the simulated board
+
+        :return: None
+        """
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def _start(self):
+        """
+        Start the reporting task the first time the simulator is used
+
+        :returns: No return value.
+        """
+        if self._task:
+            return
+        loop = asyncio.get_event_loop()
+        self._start_time = loop.time()
+        self._data_ready = asyncio.Event()
+        self._task = loop.create_task(self._report_loop())
+
+    async def _wait_for_data(self):
+        """
+        Wait until the simulated board has sent data
+
+        :returns: No return value.
+        """
+        self._start()
+        if self.rx_index >= len(self.rx_buffer):
+            del self.rx_buffer[:]
+            self.rx_index = 0
+        while not self.rx_buffer:
+            self._data_ready.clear()
+            await self._data_ready.wait()
+
+    def _send(self, data):
+        """
+        Queue data for the client to read
+
+        :param data: list of bytes
+        :returns: No return value.
+        """
+        self.rx_buffer += bytes(data)
+        if self._data_ready:
+            self._data_ready.set()
+
+    def _send_sysex(self, command, data):
+        """
+        Queue a sysex message for the client to read
+
+        :param command: sysex command
+        :param data: sysex data
+        :returns: No return value.
+        """
+        self._send([PrivateConstants.START_SYSEX, command] + list(data) +
+                   [PrivateConstants.END_SYSEX])
+
+    async def _report_loop(self):
+        """
+        Send the periodic reports of the simulated board once every
+        sampling interval, scaled by the simulation speed.
+
+        :returns: This method never returns
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            interval = self.sampling_interval / 1000 / self.speed
+            await asyncio.sleep(interval)
+            now = loop.time()
+
+            for pin in sorted(self.analog_reporting):
+                if self.analog_source:
+                    value = int(self.analog_source(pin,
+                                                   self.simulated_time()))
+                else:
+                    value = self.analog_inputs[pin]
+                self._send([PrivateConstants.ANALOG_MESSAGE + pin,
+                            value & 0x7f, (value >> 7) & 0x7f])
+
+            for (address, register), count in \
+                    self.i2c_continuous_reads.items():
+                self._i2c_reply(address, register, count)
+
+            for pin_a, (pin_b, position, position_b) in self.encoders.items():
+                data = [pin_a, position & 0x7f, (position >> 7) & 0x7f]
+                if self.hall_encoder:
+                    data += [pin_b, position_b & 0x7f,
+                             (position_b >> 7) & 0x7f]
+                self._send_sysex(PrivateConstants.ENCODER_DATA, data)
+
+            for trigger_pin, sonar in self.sonars.items():
+                if now >= sonar[2]:
+                    sonar[2] = now + sonar[0] / 1000 / self.speed
+                    self._send_sysex(PrivateConstants.SONAR_DATA,
+                                     [trigger_pin, sonar[1] & 0x7f,
+                                      (sonar[1] >> 7) & 0x7f])
+
+            if self.pixy_max_blocks is not None:
+                self._report_pixy()
+
+    def _report_digital_port(self, port, force=False):
+        """
+        Send a digital message for a port if its inputs changed
+
+        :param port: port number
+        :param force: If True, report even if the inputs have not changed
+        :returns: No return value.
+        """
+        value = 0
+        for bit in range(8):
+            pin = port * 8 + bit
+            if pin < self.digital_pin_count and self.digital_inputs[pin]:
+                value |= 1 << bit
+        if force or self.reported_ports.get(port) != value:
+            self.reported_ports[port] = value
+            self._send([PrivateConstants.DIGITAL_MESSAGE + port,
+                        value & 0x7f, (value >> 7) & 0x7f])
+
+    def _report_pixy(self):
+        """
+        Send a pixy blocks report
+
+        :returns: No return value.
+        """
+        blocks = self.pixy_blocks[:self.pixy_max_blocks]
+        data = [len(blocks)]
+        for block in blocks:
+            for key in ('signature', 'x', 'y', 'width', 'height', 'angle'):
+                value = block.get(key, 0)
+                data += [value & 0x7f, (value >> 7) & 0x7f]
+        self._send_sysex(PrivateConstants.PIXY_DATA, data)
+
+    def _i2c_reply(self, address, register, count):
+        """
+        Send an i2c read reply
+
+        :param address: i2c device address
+        :param register: register number
+        :param count: number of data bytes
+        :returns: No return value.
+        """
+        values = self.i2c_data.get(address, {}).get(register, [])
+        values = (list(values) + [0] * count)[:count]
+        data = [address & 0x7f, (address >> 7) & 0x7f,
+                register & 0x7f, (register >> 7) & 0x7f]
+        for value in values:
+            data += [value & 0x7f, (value >> 7) & 0x7f]
+        self._send_sysex(PrivateConstants.I2C_REPLY, data)
+
+    def _process_message(self, command, data):
+        """
+        Act on a message sent by the client
+
+        :param command: message command
+        :param data: message data
+        :returns: No return value.
+        """
+        if command == PrivateConstants.DIGITAL_MESSAGE:
+            port = data[0]
+            value = data[1] + (data[2] << 7)
+            for bit in range(8):
+                pin = port * 8 + bit
+                if pin < self.digital_pin_count and \
+                        self.pin_modes[pin] == Constants.OUTPUT:
+                    self.pin_values[pin] = (value >> bit) & 1
+        elif command == PrivateConstants.ANALOG_MESSAGE:
+            self.pin_values[data[0]] = data[1] + (data[2] << 7)
+        elif command == PrivateConstants.REPORT_ANALOG:
+            if data[1]:
+                self.analog_reporting.add(data[0])
+            else:
+                self.analog_reporting.discard(data[0])
+        elif command == PrivateConstants.REPORT_DIGITAL:
+            if data[1]:
+                self.digital_reporting.add(data[0])
+                self._report_digital_port(data[0], True)
+            else:
+                self.digital_reporting.discard(data[0])
+        elif command == PrivateConstants.SET_PIN_MODE:
+            if data[0] < self.digital_pin_count:
+                self.pin_modes[data[0]] = data[1]
+        elif command == PrivateConstants.SET_DIGITAL_PIN_VALUE:
+            if data[0] < self.digital_pin_count:
+                self.pin_values[data[0]] = data[1]
+        elif command == PrivateConstants.REPORT_VERSION:
+            self._send([PrivateConstants.REPORT_VERSION,
+                        self.firmware_version[0], self.firmware_version[1]])
+        elif command == PrivateConstants.SYSTEM_RESET:
+            self._reset()
+        else:
+            self._process_sysex(command, data[1:-1])
+
+    def _process_sysex(self, command, data):
+        """
+        Act on a sysex message sent by the client
+
+        :param command: sysex command
+        :param data: sysex data without the command and END_SYSEX
+        :returns: No return value.
+        """
+        if command == PrivateConstants.REPORT_FIRMWARE:
+            name = []
+            for character in self.firmware_name:
+                name += [ord(character) & 0x7f, (ord(character) >> 7) & 0x7f]
+            self._send_sysex(PrivateConstants.REPORT_FIRMWARE,
+                             list(self.firmware_version) + name)
+
+        elif command == PrivateConstants.CAPABILITY_QUERY:
+            report = []
+            for pin in range(self.digital_pin_count):
+                report += [Constants.INPUT, 1, Constants.OUTPUT, 1]
+                if self.analog_map[pin] != Constants.IGNORE:
+                    report += [Constants.ANALOG, 10]
+                if pin in self.pwm_pins:
+                    report += [Constants.PWM, 8]
+                report += [Constants.SERVO, 14, Constants.IGNORE]
+            self._send_sysex(PrivateConstants.CAPABILITY_RESPONSE, report)
+
+        elif command == PrivateConstants.ANALOG_MAPPING_QUERY:
+            self._send_sysex(PrivateConstants.ANALOG_MAPPING_RESPONSE,
+                             self.analog_map)
+
+        elif command == PrivateConstants.PIN_STATE_QUERY:
+            pin = data[0]
+            if pin < self.digital_pin_count:
+                value = self.pin_values[pin]
+                report = [pin, self.pin_modes[pin], value & 0x7f]
+                value >>= 7
+                while value:
+                    report.append(value & 0x7f)
+                    value >>= 7
+                self._send_sysex(PrivateConstants.PIN_STATE_RESPONSE, report)
+
+        elif command == PrivateConstants.SAMPLING_INTERVAL:
+            self.sampling_interval = max(data[0] + (data[1] << 7), 1)
+
+        elif command == PrivateConstants.EXTENDED_ANALOG:
+            value = 0
+            for position, byte in enumerate(data[1:]):
+                value += byte << (7 * position)
+            self.pin_values[data[0]] = value
+
+        elif command == PrivateConstants.SERVO_CONFIG:
+            self.pin_modes[data[0]] = Constants.SERVO
+
+        elif command == PrivateConstants.I2C_REQUEST:
+            address = data[0]
+            mode = data[1] & Constants.I2C_READ_WRITE_MODE_MASK
+            values = [data[i] + (data[i + 1] << 7)
+                      for i in range(2, len(data) - 1, 2)]
+            if mode == Constants.I2C_WRITE:
+                if values:
+                    self.set_i2c_data(address, values[0], values[1:])
+            elif mode == Constants.I2C_READ:
+                self._i2c_reply(address, values[0], values[1])
+            elif mode == Constants.I2C_READ_CONTINUOUSLY:
+                self.i2c_continuous_reads[(address, values[0])] = values[1]
+            elif mode == Constants.I2C_STOP_READING:
+                for key in list(self.i2c_continuous_reads):
+                    if key[0] == address:
+                        del self.i2c_continuous_reads[key]
+
+        elif command == PrivateConstants.SONAR_CONFIG:
+            trigger_pin = data[0]
+            max_distance = data[3] + (data[4] << 7)
+            if trigger_pin not in self.sonars:
+                self.sonars[trigger_pin] = [data[2], max_distance, 0]
+
+        elif command == PrivateConstants.ENCODER_CONFIG:
+            self.encoders[data[0]] = [data[1], 0, 0]
+
+        elif command == PrivateConstants.PIXY_CONFIG:
+            subcommand = data[0]
+            if subcommand == PrivateConstants.PIXY_INIT:
+                self.pixy_max_blocks = data[1]
+            else:
+                values = [data[i] + (data[i + 1] << 7)
+                          for i in range(1, len(data) - 1, 2)]
+                self.pixy_settings[subcommand] = values
+
+        elif command == PrivateConstants.STEPPER_DATA:
+            subcommand = data[0]
+            if subcommand == PrivateConstants.STEPPER_CONFIGURE:
+                self.stepper_config = [data[1] + (data[2] << 7)] + \
+                    list(data[3:])
+            elif subcommand == PrivateConstants.STEPPER_STEP:
+                steps = data[4] + (data[5] << 7)
+                if data[6]:
+                    self.stepper_position += steps
+                else:
+                    self.stepper_position -= steps
+
+        elif command == PrivateConstants.TONE_DATA:
+            pin = data[1]
+            if data[0] == Constants.TONE_TONE:
+                self.tones[pin] = [data[2] + (data[3] << 7),
+                                   data[4] + (data[5] << 7)]
+            else:
+                self.tones.pop(pin, None)
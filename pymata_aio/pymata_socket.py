@@ -23,13 +23,22 @@ import sys
 
 # noinspection PyStatementEffect,PyUnresolvedReferences,PyUnresolvedReferences
 class PymataSocket:
-    def __init__(self, ip_address, port, loop):
+    # maximum number of bytes requested from the stream reader at a time
+    READ_SIZE = 4096
+
+    def __init__(self, ip_address, port, loop, exit_on_error=True):
         self.ip_address = ip_address
         self.port = port
         self.loop = loop
+        self.exit_on_error = exit_on_error
         self.reader = None
         self.writer = None
 
+        # bytes received from the IP device and the index of the
+        # next byte to be consumed
+        self.rx_buffer = bytearray()
+        self.rx_index = 0
+
     async def start(self):
         """
         This method opens an IP connection on the IP device
@@ -41,23 +50,67 @@ class PymataSocket:
                 self.ip_address, self.port, loop=self.loop)
         except OSError:
             print("Can't open connection to " + self.ip_address)
+            if not self.exit_on_error:
+                raise
             sys.exit(0)
 
     async def write(self, data):
         """
         This method writes sends data to the IP device
-        :param data:
+        :param data: bytes or bytearray to send
 
         :return: None
         """
-        self.writer.write((bytes([ord(data)])))
+        self.writer.write(data)
         await self.writer.drain()
 
+    async def close(self):
+        """
+        This method closes the IP connection
+
+        :return: None
+        """
+        if self.writer:
+            self.writer.close()
+
     async def read(self):
         """
         This method reads one byte of data from IP device
 
         :return: Next byte
         """
-        buffer = await self.reader.read(1)
-        return ord(buffer)
+        if self.rx_index >= len(self.rx_buffer):
+            await self._fill_buffer()
+        data = self.rx_buffer[self.rx_index]
+        self.rx_index += 1
+        return data
+
+    async def read_bytes(self):
+        """
+        This method returns all of the data currently held in the
+        receive buffer, waiting until at least one byte is available.
+
+        :return: bytes read
+        """
+        if self.rx_index >= len(self.rx_buffer):
+            await self._fill_buffer()
+        with memoryview(self.rx_buffer) as view:
+            data = bytes(view[self.rx_index:])
+        del self.rx_buffer[:]
+        self.rx_index = 0
+        return data
+
+    async def _fill_buffer(self):
+        """
+        This method waits for data from the IP device and appends
+        everything available, up to READ_SIZE bytes, to the receive buffer.
+
+        :return: None
+        """
+        if self.rx_index >= len(self.rx_buffer):
+            del self.rx_buffer[:]
+            self.rx_index = 0
+        data = await self.reader.read(self.READ_SIZE)
+        if not data:
+            raise EOFError('Connection closed by ' + self.ip_address)
+        self.rx_buffer += data
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+"""
+Copyright (c) 2016 Alan Yorinks All rights reserved.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU  General Public
+License as published by the Free Software Foundation; either
+version 3 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+ General Public License for more details.
+
+You should have received a copy of the GNU  General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+Benchmarks for the pymata_aio decode, dispatch and write paths.
+No hardware is required - all traffic is generated in memory or by
+PymataSimulator.
+
+Results are printed as JSON, or written to a file with --output, so that
+runs can be compared over time.
+
+usage: benchmark.py [-h] [--count COUNT] [--output OUTPUT]
+
+The script can be run from any directory. The pymata_aio package in this
+source tree is used in preference to an installed one.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+# benchmark the source tree this script belongs to
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymata_aio.constants import Constants
+from pymata_aio.firmata_parser import FirmataParser
+from pymata_aio.private_constants import PrivateConstants
+from pymata_aio.pymata3 import PyMata3
+from pymata_aio.pymata_core import PymataCore
+from pymata_aio.pymata_simulator import PymataSimulator
+
+# size of the chunks the generated byte streams are split into,
+# roughly what a serial port delivers per read at 57600 baud
+CHUNK_SIZE = 64
+
+
+def analog_messages(count):
+    """
+    :param count: number of messages
+    :returns: a stream of analog messages for pins A0 - A5
+    """
+    stream = bytearray()
+    for i in range(count):
+        value = i % 1024
+        stream += bytes([PrivateConstants.ANALOG_MESSAGE + i % 6,
+                         value & 0x7f, value >> 7])
+    return bytes(stream)
+
+
+def digital_messages(count):
+    """
+    :param count: number of messages
+    :returns: a stream of digital messages for ports 0 - 2
+    """
+    stream = bytearray()
+    for i in range(count):
+        value = i & 0xff
+        stream += bytes([PrivateConstants.DIGITAL_MESSAGE + i % 3,
+                         value & 0x7f, value >> 7])
+    return bytes(stream)
+
+
+def i2c_reply_messages(count):
+    """
+    :param count: number of messages
+    :returns: a stream of 6 byte i2c replies from device 0x1d register 1
+    """
+    message = [PrivateConstants.START_SYSEX, PrivateConstants.I2C_REPLY,
+               0x1d, 0, 1, 0]
+    for value in range(6):
+        message += [value, 0]
+    message.append(PrivateConstants.END_SYSEX)
+    return bytes(message) * count
+
+
+def pixy_messages(count):
+    """
+    :param count: number of messages
+    :returns: a stream of pixy reports containing 2 blocks each
+    """
+    message = [PrivateConstants.START_SYSEX, PrivateConstants.PIXY_DATA, 2]
+    for block in range(2):
+        for value in (1, 160, 100, 20, 30, 0):
+            message += [value & 0x7f, value >> 7]
+    message.append(PrivateConstants.END_SYSEX)
+    return bytes(message) * count
+
+
+def encoder_messages(count):
+    """
+    :param count: number of messages
+    :returns: a stream of encoder reports for pin 2
+    """
+    stream = bytearray()
+    for i in range(count):
+        value = i % 8192
+        stream += bytes([PrivateConstants.START_SYSEX,
+                         PrivateConstants.ENCODER_DATA, 2,
+                         value & 0x7f, value >> 7,
+                         PrivateConstants.END_SYSEX])
+    return bytes(stream)
+
+
+TRAFFIC = {'analog': analog_messages,
+           'digital': digital_messages,
+           'i2c_reply': i2c_reply_messages,
+           'pixy': pixy_messages,
+           'encoder': encoder_messages}
+
+
+def chunks(stream):
+    """
+    :param stream: bytes
+    :returns: the stream split into CHUNK_SIZE pieces
+    """
+    return [stream[i:i + CHUNK_SIZE] for i in range(0, len(stream),
+                                                    CHUNK_SIZE)]
+
+
+def percentiles(samples):
+    """
+    :param samples: list of latencies in seconds
+    :returns: dictionary of latency percentiles in microseconds
+    """
+    samples = sorted(samples)
+    result = {}
+    for name, fraction in (('p50', .5), ('p90', .9), ('p99', .99),
+                           ('max', 1.0)):
+        index = min(int(len(samples) * fraction), len(samples) - 1)
+        result[name] = round(samples[index] * 1000000, 2)
+    return result
+
+
+class StreamTransport:
+    """
+    A transport that hands a fixed list of chunks to the dispatcher
+    and records everything written.
+    """
+
+    def __init__(self, data_chunks=None):
+        self.data_chunks = list(data_chunks or [])
+        self.index = 0
+        self.finished = asyncio.Future()
+        self.pending = None
+        self.bytes_written = 0
+
+    async def read(self):
+        return (await self.read_bytes())[0]
+
+    async def read_bytes(self):
+        if self.index < len(self.data_chunks):
+            self.index += 1
+            return self.data_chunks[self.index - 1]
+        if not self.finished.done():
+            self.finished.set_result(True)
+        # wait for more data to be pushed
+        self.pending = asyncio.Future()
+        return await self.pending
+
+    def push(self, data):
+        if self.pending and not self.pending.done():
+            self.pending.set_result(data)
+        else:
+            self.data_chunks.append(data)
+
+    async def write(self, data):
+        self.bytes_written += len(data)
+        return len(data)
+
+
+def make_core(transport, loop):
+    """
+    Create a PymataCore for a transport with Uno sized pin lists without
+    starting the transport.
+
+    :returns: PymataCore instance
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        core = PymataCore(transport=transport)
+        core.read = transport.read
+        core.read_bytes = transport.read_bytes
+        core.write = transport.write
+        core.loop = loop
+        core._build_pin_lists([Constants.IGNORE] * 14 + list(range(6)))
+    core.i2c_map[0x1d] = {'value': None, 'callback': None,
+                          'callback_type': None}
+    return core
+
+
+def benchmark_parser(stream, count):
+    """
+    :returns: messages per second decoded by FirmataParser alone
+    """
+    data_chunks = chunks(stream)
+    parser = FirmataParser()
+    start = time.perf_counter()
+    decoded = 0
+    for chunk in data_chunks:
+        decoded += len(parser.feed(chunk))
+    elapsed = time.perf_counter() - start
+    assert decoded == count
+    return round(count / elapsed)
+
+
+def benchmark_dispatch(stream, count, loop):
+    """
+    :returns: messages per second decoded and handled by PymataCore
+    """
+    transport = StreamTransport(chunks(stream))
+    core = make_core(transport, loop)
+    start = time.perf_counter()
+    task = loop.create_task(core._command_dispatcher())
+    loop.run_until_complete(transport.finished)
+    elapsed = time.perf_counter() - start
+    task.cancel()
+    return round(count / elapsed)
+
+
+def benchmark_callback_latency(samples, loop):
+    """
+    Measure the time from an analog message becoming readable to its
+    callback running.
+
+    :returns: latency percentiles in microseconds
+    """
+    transport = StreamTransport()
+    core = make_core(transport, loop)
+    latencies = []
+    received = [None]
+
+    def callback(data):
+        latencies.append(time.perf_counter() - received[0])
+
+    core.analog_pins[0].cb = callback
+    task = loop.create_task(core._command_dispatcher())
+
+    async def run():
+        await asyncio.sleep(0)
+        for i in range(samples):
+            value = i % 1024
+            received[0] = time.perf_counter()
+            transport.push(bytes([PrivateConstants.ANALOG_MESSAGE,
+                                  value & 0x7f, value >> 7]))
+            while len(latencies) <= i:
+                await asyncio.sleep(0)
+
+    loop.run_until_complete(run())
+    task.cancel()
+    return percentiles(latencies)
+
+
+def benchmark_writes(count, loop):
+    """
+    :returns: frames per second sent through _send_command and _send_sysex
+    """
+    transport = StreamTransport()
+    core = make_core(transport, loop)
+
+    async def commands():
+        for i in range(count):
+            await core._send_command([PrivateConstants.ANALOG_MESSAGE + 3,
+                                      i & 0x7f, 0])
+
+    async def sysex():
+        for i in range(count):
+            await core._send_sysex(PrivateConstants.I2C_REQUEST,
+                                   [0x70, 0, 0, 0, i & 0x7f, 0, 1, 0])
+
+    results = {}
+    for name, coroutine in (('send_command', commands),
+                            ('send_sysex', sysex)):
+        start = time.perf_counter()
+        loop.run_until_complete(coroutine())
+        results[name] = round(count / (time.perf_counter() - start))
+    return results
+
+
+def benchmark_pymata3(count):
+    """
+    :returns: PyMata3 per call overhead in microseconds
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        board = PyMata3(arduino_wait=0,
+                        transport=PymataSimulator(speed=100))
+        board.sleep = lambda duration: None
+
+    results = {}
+    for name, call in (('analog_read', lambda: board.analog_read(2)),
+                       ('digital_read', lambda: board.digital_read(2)),
+                       ('digital_write', lambda: board.digital_write(13, 1)),
+                       ('analog_write', lambda: board.analog_write(5, 128))):
+        start = time.perf_counter()
+        for _ in range(count):
+            call()
+        results[name] = round((time.perf_counter() - start) / count *
+                              1000000, 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=20000,
+                        help='Number of messages per measurement')
+    parser.add_argument('--output', help='Write the JSON results to a file')
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    results = {'pymata_version': PrivateConstants.PYMATA_VERSION,
+               'python': platform.python_version(),
+               'time_stamp': time.time(),
+               'count': args.count,
+               'decode_messages_per_second': {},
+               'dispatch_messages_per_second': {}}
+
+    for name, generator in sorted(TRAFFIC.items()):
+        stream = generator(args.count)
+        results['decode_messages_per_second'][name] = \
+            benchmark_parser(stream, args.count)
+        results['dispatch_messages_per_second'][name] = \
+            benchmark_dispatch(stream, args.count, loop)
+
+    results['callback_latency_us'] = \
+        benchmark_callback_latency(min(args.count, 5000), loop)
+    results['write_frames_per_second'] = benchmark_writes(args.count, loop)
+    results['pymata3_call_overhead_us'] = \
+        benchmark_pymata3(min(args.count, 2000))
+
+    report = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(report + '\n')
+    else:
+        print(report)
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
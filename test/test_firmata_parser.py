@@ -0,0 +1,124 @@
+"""
+Copyright (c) 2016 Alan Yorinks All rights reserved.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU  General Public
+License as published by the Free Software Foundation; either
+version 3 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+FirmataParser tests. No hardware is required.
+"""
+
+import asyncio
+import contextlib
+import io
+
+from pymata_aio.constants import Constants
+from pymata_aio.firmata_parser import FirmataParser
+from pymata_aio.private_constants import PrivateConstants
+from pymata_aio.pymata_core import PymataCore
+from pymata_aio.pymata_simulator import PymataSimulator
+
+START_SYSEX = PrivateConstants.START_SYSEX
+END_SYSEX = PrivateConstants.END_SYSEX
+ANALOG_MESSAGE = PrivateConstants.ANALOG_MESSAGE
+DIGITAL_MESSAGE = PrivateConstants.DIGITAL_MESSAGE
+REPORT_VERSION = PrivateConstants.REPORT_VERSION
+PIN_STATE_RESPONSE = PrivateConstants.PIN_STATE_RESPONSE
+
+
+def feed_all(chunks):
+    """
+    :param chunks: list of byte strings passed to one parser in turn
+    :returns: list of all messages returned
+    """
+    parser = FirmataParser()
+    messages = []
+    for chunk in chunks:
+        messages.extend(parser.feed(bytes(chunk)))
+    return messages
+
+
+def test_channel_number_is_masked():
+    messages = feed_all([[DIGITAL_MESSAGE | 3, 0x01, 0x00,
+                          ANALOG_MESSAGE | 0x0e, 0x7f, 0x07]])
+    assert messages == [(DIGITAL_MESSAGE, [3, 0x01, 0x00]),
+                        (ANALOG_MESSAGE, [14, 0x7f, 0x07])]
+
+
+def test_message_split_across_feeds():
+    stream = [ANALOG_MESSAGE | 2, 0x10, 0x02, REPORT_VERSION, 2, 5]
+    expected = [(ANALOG_MESSAGE, [2, 0x10, 0x02]),
+                (REPORT_VERSION, [2, 5])]
+    # every possible split point, and one byte at a time
+    for split in range(len(stream) + 1):
+        assert feed_all([stream[:split], stream[split:]]) == expected
+    assert feed_all([[byte] for byte in stream]) == expected
+
+
+def test_sysex_frame_includes_end_sysex():
+    frame = [START_SYSEX, PIN_STATE_RESPONSE, 5, Constants.PWM, 0, END_SYSEX]
+    messages = feed_all([frame])
+    assert messages == [(PIN_STATE_RESPONSE,
+                         [PIN_STATE_RESPONSE, 5, Constants.PWM, 0,
+                          END_SYSEX])]
+
+
+def test_sysex_frame_split_at_end_sysex():
+    frame = [START_SYSEX, PIN_STATE_RESPONSE, 5, Constants.PWM, 0, END_SYSEX]
+    following = [DIGITAL_MESSAGE | 1, 0x04, 0x00]
+    expected = [(PIN_STATE_RESPONSE,
+                 [PIN_STATE_RESPONSE, 5, Constants.PWM, 0, END_SYSEX]),
+                (DIGITAL_MESSAGE, [1, 0x04, 0x00])]
+    # END_SYSEX alone in the next chunk, and followed by a channel message
+    assert feed_all([frame[:-1], frame[-1:] + following]) == expected
+    assert feed_all([frame[:-1], frame[-1:], following]) == expected
+    # END_SYSEX at the end of a chunk, next message in the next chunk
+    assert feed_all([frame, following]) == expected
+
+
+def test_empty_sysex_and_stray_bytes_are_ignored():
+    messages = feed_all([[0x12, START_SYSEX, END_SYSEX, 0x7f, 0xa0,
+                          DIGITAL_MESSAGE, 0x01, 0x00]])
+    assert messages == [(DIGITAL_MESSAGE, [0, 0x01, 0x00])]
+
+
+def test_split_chunks_reach_the_core():
+    class ChunkedBoard(PymataSimulator):
+        """
+        A simulated board that delivers its replies one byte at a time
+        """
+
+        async def read_bytes(self):
+            return bytes([await self.read()])
+
+    async def main():
+        board = ChunkedBoard(speed=100)
+        with contextlib.redirect_stdout(io.StringIO()):
+            core = PymataCore(arduino_wait=0, transport=board,
+                              query_timeout=1)
+            await core.start_aio()
+        try:
+            await core.set_pin_mode(5, Constants.PWM)
+            assert await core.get_pin_state(5) == [5, Constants.PWM, 0]
+            assert await core.get_firmware_version() == \
+                '2.5 FirmataPlus.ino'
+        finally:
+            with contextlib.redirect_stdout(io.StringIO()):
+                await core.close()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
@@ -0,0 +1,124 @@
+"""
+Copyright (c) 2016 Alan Yorinks All rights reserved.
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU  General Public
+License as published by the Free Software Foundation; either
+version 3 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+Query and reply matching tests. No hardware is required - the board is
+a PymataSimulator.
+"""
+
+import asyncio
+import contextlib
+import io
+
+from pymata_aio.constants import Constants
+from pymata_aio.private_constants import PrivateConstants
+from pymata_aio.pymata_core import PymataCore
+from pymata_aio.pymata_simulator import PymataSimulator
+
+PIN_STATE_QUERY = bytes([PrivateConstants.START_SYSEX,
+                         PrivateConstants.PIN_STATE_QUERY])
+
+
+class UnreliableBoard(PymataSimulator):
+    """
+    A simulated board that can drop pin state queries, or process
+    everything written to it after a delay. Delayed writes are processed
+    in order, so replies arrive in query order as from a real board.
+    """
+
+    def __init__(self):
+        super().__init__(speed=100)
+        self.drop_queries = False
+        self.reply_delay = None
+
+    async def write(self, data):
+        if self.drop_queries and PIN_STATE_QUERY in data:
+            return len(data)
+        if self.reply_delay:
+            asyncio.get_event_loop().call_later(
+                self.reply_delay, self.process, bytes(data))
+            return len(data)
+        return await super().write(data)
+
+    def process(self, data):
+        asyncio.ensure_future(super().write(data))
+
+
+def run(test):
+    """
+    Start a PymataCore on an UnreliableBoard and run a test coroutine
+
+    :param test: coroutine function called as test(core, board)
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    board = UnreliableBoard()
+
+    async def main():
+        with contextlib.redirect_stdout(io.StringIO()):
+            core = PymataCore(arduino_wait=0, transport=board,
+                              query_timeout=0.2)
+            await core.start_aio()
+        try:
+            await test(core, board)
+        finally:
+            with contextlib.redirect_stdout(io.StringIO()):
+                await core.close()
+
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+def test_retry_after_dropped_query():
+    async def test(core, board):
+        await core.set_pin_mode(5, Constants.PWM)
+        board.drop_queries = True
+        assert await core.get_pin_state(5) is None
+
+        # the board never answers the first query, so the retry must
+        # not lose its own reply
+        board.drop_queries = False
+        assert await core.get_pin_state(5) == [5, Constants.PWM, 0]
+
+        # and later queries are answered at once
+        start = core.loop.time()
+        assert await core.get_pin_state(5) == [5, Constants.PWM, 0]
+        assert core.loop.time() - start < 0.1
+
+    run(test)
+
+
+def test_late_reply_not_given_to_retry():
+    async def test(core, board):
+        await core.set_pin_mode(5, Constants.INPUT)
+        board.reply_delay = 0.3
+        assert await core.get_pin_state(5) is None
+
+        # the late reply reports INPUT and arrives while the retry waits
+        await core.set_pin_mode(5, Constants.PWM)
+        assert await core.get_pin_state(5, timeout=1) == \
+            [5, Constants.PWM, 0]
+
+    run(test)
+
+
+def test_late_firmware_reply_is_kept():
+    async def test(core, board):
+        assert await core.get_firmware_version() == '2.5 FirmataPlus.ino'
+
+    run(test)